@@ -0,0 +1,271 @@
+"""
+准入控制模块
+按操作人（发送者open_id）做加权公平排队，限制全局与单个操作人的在途数、排队数和速率；快速指令走优先通道不排队
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from tracing import span
+
+# 快速通道：只访问本地数据的指令，不经过排队
+LANE_FAST = "fast"
+# 慢速通道：需要调用觅智网接口的成员操作
+LANE_SLOW = "slow"
+
+
+class AdmissionRejected(Exception):
+    """操作人排队的操作数已达上限，本次操作不排队直接拒绝"""
+
+
+class _Waiter:
+    __slots__ = ("operator", "tag", "future", "enqueued_at")
+
+    def __init__(self, operator: str, tag: float, future: asyncio.Future):
+        self.operator = operator
+        self.tag = tag
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class _WaitStats:
+    """等待时间统计"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, wait: float) -> None:
+        self.count += 1
+        self.total += wait
+        self.max = max(self.max, wait)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "avg_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "max_ms": self.max * 1000,
+        }
+
+
+class AdmissionController:
+    def __init__(self, max_inflight: int = 20, operator_max_inflight: int = 2, operator_rate_per_min: float = 30,
+                 operator_burst: int = 5, weights: Optional[Dict[str, float]] = None, operator_max_queue: int = 20):
+        """初始化准入控制
+
+        只能在异步引擎的事件循环中使用
+
+        Args:
+            max_inflight: 慢速通道全局在途上限（觅智网接口并发）
+            operator_max_inflight: 单个操作人在途上限
+            operator_rate_per_min: 单个操作人每分钟可开始的操作数，0表示不限速
+            operator_burst: 单个操作人可突发的操作数（令牌桶容量）
+            weights: 操作人权重，未配置的操作人权重为1
+            operator_max_queue: 单个操作人排队中的操作数上限，超出时立即拒绝，0表示不限制
+        """
+        self.max_inflight = max_inflight
+        self.operator_max_inflight = operator_max_inflight
+        self.operator_rate_per_min = operator_rate_per_min
+        self.operator_burst = operator_burst
+        self.weights = weights or {}
+        self.operator_max_queue = operator_max_queue
+
+        self._inflight = 0
+        self._operator_inflight: Dict[str, int] = {}
+        self._queues: Dict[str, Deque[_Waiter]] = {}
+        # 加权公平排队的虚拟时间与各操作人最近一次的完成标签
+        self._virtual_time = 0.0
+        self._last_tag: Dict[str, float] = {}
+        # 令牌桶：操作人 -> (令牌数, 上次补充时间)
+        self._buckets: Dict[str, tuple] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        self._lane_waits: Dict[str, _WaitStats] = {LANE_FAST: _WaitStats(), LANE_SLOW: _WaitStats()}
+        self._operator_waits: Dict[str, _WaitStats] = {}
+        self._rejected: Dict[str, int] = {}
+
+    def _tokens(self, operator: str, now: float) -> float:
+        """补充并返回操作人当前的令牌数"""
+        if self.operator_rate_per_min <= 0:
+            return float("inf")
+        tokens, updated = self._buckets.get(operator, (self.operator_burst, now))
+        tokens = min(self.operator_burst, tokens + (now - updated) * self.operator_rate_per_min / 60)
+        self._buckets[operator] = (tokens, now)
+        return tokens
+
+    def _record_wait(self, operator: str, wait: float) -> None:
+        self._lane_waits[LANE_SLOW].add(wait)
+        self._operator_waits.setdefault(operator, _WaitStats()).add(wait)
+
+    def _dispatch(self) -> None:
+        """按完成标签从小到大放行满足在途和速率限制的等待者"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        next_token_in: Optional[float] = None
+        while self._inflight < self.max_inflight:
+            now = time.monotonic()
+            best: Optional[_Waiter] = None
+            for operator, queue in self._queues.items():
+                if not queue or self._operator_inflight.get(operator, 0) >= self.operator_max_inflight:
+                    continue
+                tokens = self._tokens(operator, now)
+                if tokens < 1:
+                    wait = (1 - tokens) * 60 / self.operator_rate_per_min
+                    next_token_in = wait if next_token_in is None else min(next_token_in, wait)
+                    continue
+                if best is None or queue[0].tag < best.tag:
+                    best = queue[0]
+
+            if best is None:
+                break
+
+            operator = best.operator
+            self._queues[operator].popleft()
+            if not self._queues[operator]:
+                del self._queues[operator]
+            if self.operator_rate_per_min > 0:
+                tokens, updated = self._buckets[operator]
+                self._buckets[operator] = (tokens - 1, updated)
+            self._virtual_time = max(self._virtual_time, best.tag)
+            self._inflight += 1
+            self._operator_inflight[operator] = self._operator_inflight.get(operator, 0) + 1
+            self._record_wait(operator, time.perf_counter() - best.enqueued_at)
+            best.future.set_result(True)
+
+        # 有操作人只因速率限制而等待时，在令牌补充后重新调度
+        if next_token_in is not None and self._queues:
+            self._timer = asyncio.get_running_loop().call_later(next_token_in, self._dispatch)
+
+    def _release(self, operator: str) -> None:
+        self._inflight -= 1
+        self._operator_inflight[operator] -= 1
+        if not self._operator_inflight[operator]:
+            del self._operator_inflight[operator]
+        if not self._queues:
+            # 无人排队时各操作人的标签都不超过虚拟时间，清空不影响排序，避免记录无限增长
+            self._last_tag.clear()
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, operator: Optional[str], lane: str = LANE_SLOW) -> AsyncIterator[None]:
+        """获取执行名额，退出时归还
+
+        Args:
+            operator: 操作人open_id
+            lane: 通道，快速通道直接放行
+
+        Raises:
+            AdmissionRejected: 操作人排队的操作数已达上限
+        """
+        if lane == LANE_FAST:
+            self._lane_waits[LANE_FAST].add(0.0)
+            yield
+            return
+
+        operator = operator or "anonymous"
+        if self.operator_max_queue and len(self._queues.get(operator, ())) >= self.operator_max_queue:
+            self._operator_waits.setdefault(operator, _WaitStats())
+            self._rejected[operator] = self._rejected.get(operator, 0) + 1
+            raise AdmissionRejected(f"操作人 {operator} 排队的操作数已达上限 {self.operator_max_queue}")
+
+        weight = self.weights.get(operator, 1.0)
+        tag = max(self._virtual_time, self._last_tag.get(operator, 0.0)) + 1 / weight
+        self._last_tag[operator] = tag
+        waiter = _Waiter(operator, tag, asyncio.get_running_loop().create_future())
+        self._queues.setdefault(operator, deque()).append(waiter)
+        self._dispatch()
+
+        try:
+            with span("admission_wait", operator=operator):
+                await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 已获得名额后才被取消，需要归还
+                self._release(operator)
+            else:
+                queue = self._queues.get(operator)
+                if queue and waiter in queue:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._queues[operator]
+            raise
+
+        try:
+            yield
+        finally:
+            self._release(operator)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取各通道的等待时间，以及各操作人在成员操作通道的等待时间、在途数、排队数和被拒绝数"""
+        return {
+            "inflight": self._inflight,
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "rejected": sum(self._rejected.values()),
+            "lanes": {lane: stats.to_dict() for lane, stats in self._lane_waits.items()},
+            "operators": {
+                operator: dict(
+                    stats.to_dict(),
+                    inflight=self._operator_inflight.get(operator, 0),
+                    queued=len(self._queues.get(operator, ())),
+                    rejected=self._rejected.get(operator, 0),
+                )
+                for operator, stats in self._operator_waits.items()
+            },
+        }
+
+
+if __name__ == "__main__":
+    # 测试代码：多操作人公平轮转、单操作人速率上限、排队数上限
+    async def _run(controller: AdmissionController, operators, hold: float = 0.01):
+        """按顺序提交操作，返回各操作的(开始时间, 操作人)以及被拒绝的操作数"""
+        started = []
+        rejected = 0
+
+        async def operation(operator: str):
+            nonlocal rejected
+            try:
+                async with controller.slot(operator):
+                    started.append((time.monotonic(), operator))
+                    await asyncio.sleep(hold)
+            except AdmissionRejected:
+                rejected += 1
+
+        await asyncio.gather(*(operation(operator) for operator in operators))
+        return started, rejected
+
+    async def _main() -> None:
+        # 全局只有1个名额：A先提交4个、B随后提交2个，B不需要等A全部完成
+        controller = AdmissionController(max_inflight=1, operator_max_inflight=1, operator_rate_per_min=0)
+        started, _ = await _run(controller, ["A"] * 4 + ["B"] * 2)
+        order = "".join(operator for _, operator in started)
+        print("公平轮转顺序:", order)
+        assert order.rindex("B") < order.rindex("A")
+        assert "AAA" not in order
+
+        # B的权重为2时获得两倍的放行机会
+        controller = AdmissionController(max_inflight=1, operator_max_inflight=1, operator_rate_per_min=0, weights={"B": 2})
+        started, _ = await _run(controller, ["A"] * 4 + ["B"] * 4)
+        order = "".join(operator for _, operator in started)
+        print("加权轮转顺序:", order)
+        assert order[:6].count("B") >= 3
+
+        # 每分钟600次（每0.1秒1个令牌）、突发2次：5个操作中后3个需要等待令牌
+        controller = AdmissionController(max_inflight=10, operator_max_inflight=10, operator_rate_per_min=600, operator_burst=2)
+        started, _ = await _run(controller, ["A"] * 5, hold=0)
+        offsets = [moment - started[0][0] for moment, _ in started]
+        print("限速下的开始时间(秒):", [round(offset, 2) for offset in offsets])
+        assert offsets[1] < 0.05 and offsets[-1] >= 0.25
+
+        # 排队数上限为2：1个执行、2个排队，其余立即拒绝，其他操作人不受影响
+        controller = AdmissionController(max_inflight=10, operator_max_inflight=1, operator_rate_per_min=0, operator_max_queue=2)
+        started, rejected = await _run(controller, ["A"] * 6 + ["B"])
+        print("排队已满被拒绝:", rejected, "指标:", controller.get_metrics()["operators"]["A"]["rejected"])
+        assert rejected == 3 and len(started) == 4
+        assert [operator for _, operator in started].count("B") == 1
+
+    asyncio.get_event_loop().run_until_complete(_main())
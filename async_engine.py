@@ -0,0 +1,98 @@
+"""
+异步执行引擎模块
+在独立线程中运行事件循环，使用aiohttp发起上游请求，单进程即可同时保持大量在途请求
+"""
+import asyncio
+import concurrent.futures
+import functools
+import threading
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional
+
+import aiohttp
+
+
+class HttpResult(NamedTuple):
+    """上游HTTP请求结果"""
+    status: int
+    body: Dict[str, Any]
+    headers: Dict[str, str]
+
+
+class AsyncEngine:
+    def __init__(self, max_inflight: int = 200, timeout: float = 10):
+        """初始化异步引擎并启动事件循环线程
+
+        Args:
+            max_inflight: 同时在途的上游请求上限（连接池大小）
+            timeout: 单个请求的超时时间（秒）
+        """
+        self.max_inflight = max_inflight
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="async-engine", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def submit(self, coro: Awaitable) -> concurrent.futures.Future:
+        """提交协程到事件循环，不等待结果"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro: Awaitable, timeout: Optional[float] = None) -> Any:
+        """提交协程并阻塞等待结果，供同步接口使用
+
+        不能在事件循环线程内调用，否则会造成死锁
+        """
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("不能在异步引擎线程内调用同步接口，请直接await对应的异步方法")
+        return self.submit(coro).result(timeout)
+
+    async def run_blocking(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """在线程池中执行阻塞调用（文件读写、fsync等），避免阻塞事件循环上的其他请求"""
+        return await self._loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_inflight),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def request(self, method: str, url: str, **kwargs) -> HttpResult:
+        """发起HTTP请求并解析JSON响应
+
+        响应体不是合法JSON时抛出ValueError，与requests的response.json()行为一致
+        """
+        session = await self._get_session()
+        async with session.request(method, url, **kwargs) as response:
+            body = await response.json(content_type=None)
+            return HttpResult(response.status, body if body is not None else {}, dict(response.headers))
+
+    async def post_multipart(self, url: str, fields: Dict[str, str], **kwargs) -> HttpResult:
+        """以multipart/form-data提交表单字段（等价于requests的files=参数）"""
+        with aiohttp.MultipartWriter('form-data') as writer:
+            for name, value in fields.items():
+                part = writer.append(value)
+                part.set_content_disposition('form-data', name=name)
+        return await self.request("POST", url, data=writer, **kwargs)
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def stop(self) -> None:
+        """关闭会话并停止事件循环"""
+        if not self._loop.is_running():
+            return
+        try:
+            self.run(self.close(), timeout=self.timeout)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
@@ -0,0 +1,136 @@
+"""
+性能基准测试
+在本地桩服务上对比同步接口与异步引擎执行成员操作流水线的吞吐量和延迟，并测量各指令的路由分发开销
+
+用法: python benchmark.py [--requests 200] [--latency 0.05] [--threads 16] [--dispatch-iterations 5000]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from stub_upstream import StubUpstream
+
+
+def _summary(name: str, latencies: List[float], elapsed: float) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    result = {
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+        "max_ms": latencies[-1] * 1000,
+    }
+    print(f"{name:<24} 吞吐量 {result['throughput']:8.1f} 次/秒  P50 {result['p50_ms']:8.1f}ms  P95 {result['p95_ms']:8.1f}ms  最大 {result['max_ms']:8.1f}ms")
+    return result
+
+
+def _run_sync(bot, ids: List[str], threads: int) -> List[float]:
+    """通过同步接口执行添加+删除，threads为1时等价于逐条串行处理"""
+    def one(miz_id: str) -> float:
+        started = time.perf_counter()
+        bot.add_member(miz_id, "ou_bench")
+        bot.delete_member(miz_id, "ou_bench")
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(one, ids))
+
+
+def _run_async(bot, ids: List[str]) -> List[float]:
+    """在异步引擎上并发执行添加+删除"""
+    async def one(miz_id: str) -> float:
+        started = time.perf_counter()
+        await bot.add_member_async(miz_id, "ou_bench")
+        await bot.delete_member_async(miz_id, "ou_bench")
+        return time.perf_counter() - started
+
+    async def all_ops() -> List[float]:
+        return await asyncio.gather(*(one(miz_id) for miz_id in ids))
+
+    return bot.engine.run(all_ops())
+
+
+def _bench_dispatch(bot, iterations: int) -> None:
+    """测量各指令从消息content解析到分发完成的单次耗时（不含上游请求）"""
+    commands = ["帮助", "Cookie状态", "用户状态 12345678", "我的成员", "即将过期 2", "添加成员 abc", "不存在的指令"]
+
+    async def run() -> Dict[str, float]:
+        costs = {}
+        for text in commands:
+            content = json.dumps({"text": text}, ensure_ascii=False)
+            started = time.perf_counter()
+            for _ in range(iterations):
+                await bot.router.dispatch(bot.router.parse_content(content), "ou_bench")
+            costs[text] = (time.perf_counter() - started) / iterations * 1e6
+        return costs
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        costs = bot.engine.run(run())
+
+    print(f"指令分发开销（每条指令 {iterations} 次取平均）")
+    for text, cost in costs.items():
+        print(f"  {text:<20} {cost:8.2f}µs")
+
+
+def _measure(runner: Callable[[], List[float]]):
+    """执行一组操作，返回各操作延迟与总耗时"""
+    started = time.perf_counter()
+    latencies = runner()
+    return latencies, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同步接口与异步引擎性能对比")
+    parser.add_argument("--requests", type=int, default=200, help="每种模式执行的成员操作数")
+    parser.add_argument("--latency", type=float, default=0.05, help="桩服务模拟的上游延迟（秒）")
+    parser.add_argument("--threads", type=int, default=16, help="同步多线程模式的线程数")
+    parser.add_argument("--dispatch-iterations", type=int, default=5000, help="指令分发测量的重复次数")
+    args = parser.parse_args()
+
+    stub = StubUpstream(latency=args.latency)
+    stub.start()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        stub.configure_environment(workdir)
+        # 环境变量准备好之后再导入，保证全局实例使用临时数据文件
+        from feishu_bot import FeishuBot
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            bot = FeishuBot(start_background_tasks=False)
+
+        # 串行模式请求数减少，避免耗时过长
+        serial_count = max(1, args.requests // 10)
+        batches = {
+            "serial": [str(10000000 + i) for i in range(serial_count)],
+            "threaded": [str(20000000 + i) for i in range(args.requests)],
+            "async": [str(30000000 + i) for i in range(args.requests)],
+        }
+
+        print(f"上游延迟 {args.latency * 1000:.0f}ms，每次操作包含 添加成员+删除成员（含多维表格写入）")
+        # 机器人的操作日志较多，测量期间屏蔽输出
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = {
+                f"同步串行 (n={serial_count})": _measure(lambda: _run_sync(bot, batches["serial"], 1)),
+                f"同步{args.threads}线程 (n={args.requests})": _measure(lambda: _run_sync(bot, batches["threaded"], args.threads)),
+                f"异步引擎 (n={args.requests})": _measure(lambda: _run_async(bot, batches["async"])),
+            }
+
+        for name, (latencies, elapsed) in results.items():
+            _summary(name, latencies, elapsed)
+
+        print()
+        _bench_dispatch(bot, args.dispatch_iterations)
+
+        bot.engine.stop()
+
+    stub.stop()
+
+
+if __name__ == "__main__":
+    main()
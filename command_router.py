@@ -0,0 +1,145 @@
+"""
+指令路由模块
+消息内容只解析一次，按指令关键字查表分发到声明式注册的处理函数，并统一校验参数
+"""
+import json
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+from admission import LANE_FAST, AdmissionController, AdmissionRejected
+
+
+@dataclass
+class CommandContext:
+    """指令上下文"""
+    text: str
+    args: List[str]
+    open_id: Optional[str] = None
+    user_id: Optional[str] = None
+
+
+@dataclass
+class CommandResult:
+    """指令处理结果，由回复层渲染为消息"""
+    success: bool
+    message: str
+    command: Optional[str] = None
+    # 为True时失败结果也回复给用户（成员操作需要告知失败原因）
+    always_reply: bool = False
+
+    @property
+    def reply_text(self) -> Optional[str]:
+        """需要回复给用户的文本，不需要回复时返回None"""
+        if self.message and (self.success or self.always_reply):
+            return self.message
+        return None
+
+    def to_dict(self) -> Dict[str, object]:
+        return {"success": self.success, "message": self.message}
+
+
+Handler = Callable[[CommandContext], Awaitable[CommandResult]]
+Validator = Callable[[List[str]], Optional[str]]
+
+
+@dataclass
+class Command:
+    """已注册的指令"""
+    name: str
+    handler: Handler
+    aliases: Sequence[str] = ()
+    min_args: int = 0
+    max_args: int = 0
+    usage: str = ""
+    description: str = ""
+    validate: Optional[Validator] = None
+    always_reply: bool = False
+    lane: str = LANE_FAST
+    keys: List[str] = field(default_factory=list)
+
+
+class CommandRouter:
+    def __init__(self, unknown_message: str = "未知指令，请输入'帮助'查看可用指令",
+                 admission: Optional[AdmissionController] = None,
+                 busy_message: str = "您提交的成员操作过多，正在排队处理，请稍后再试"):
+        """初始化指令路由
+
+        Args:
+            unknown_message: 未匹配到指令时返回的提示
+            admission: 准入控制，参数校验通过后按指令通道获取执行名额，None表示不限制
+            busy_message: 操作人排队已满、准入控制拒绝时返回的提示
+        """
+        self.unknown_message = unknown_message
+        self.busy_message = busy_message
+        self.admission = admission
+        self._table: Dict[str, Command] = {}
+        self._commands: List[Command] = []
+
+    def register(self, name: str, handler: Handler, aliases: Sequence[str] = (), min_args: int = 0, max_args: int = 0,
+                 usage: str = "", description: str = "", validate: Optional[Validator] = None,
+                 always_reply: bool = False, lane: str = LANE_FAST) -> Command:
+        """注册指令
+
+        Args:
+            name: 指令关键字（消息的第一个词）
+            handler: 异步处理函数，接收CommandContext返回CommandResult
+            aliases: 指令别名
+            min_args: 最少参数个数
+            max_args: 最多参数个数
+            usage: 指令格式，用于帮助信息和参数错误提示
+            description: 指令说明，用于帮助信息
+            validate: 参数校验函数，校验失败时返回错误提示
+            always_reply: 失败结果是否也回复给用户
+            lane: 准入通道，调用觅智网接口的指令应使用慢速通道
+        """
+        command = Command(name, handler, aliases, min_args, max_args, usage or name, description, validate, always_reply,
+                          lane)
+        for key in (name, *aliases):
+            if key in self._table:
+                raise ValueError(f"指令 {key} 重复注册")
+            self._table[key] = command
+            command.keys.append(key)
+        self._commands.append(command)
+        return command
+
+    @property
+    def commands(self) -> List[Command]:
+        """按注册顺序返回所有指令"""
+        return list(self._commands)
+
+    @staticmethod
+    def parse_content(content: str) -> str:
+        """从飞书消息content中取出文本，content不是JSON时按纯文本处理"""
+        try:
+            return json.loads(content).get('text', '').strip()
+        except (ValueError, AttributeError):
+            return content.strip()
+
+    async def dispatch(self, text: str, open_id: Optional[str] = None, user_id: Optional[str] = None) -> CommandResult:
+        """分发一条已解析的文本指令"""
+        parts = text.split()
+        command = self._table.get(parts[0]) if parts else None
+        if command is None:
+            return CommandResult(False, self.unknown_message)
+
+        args = parts[1:]
+        if not command.min_args <= len(args) <= command.max_args:
+            return CommandResult(False, f"参数错误，格式：{command.usage}", command.name, command.always_reply)
+
+        if command.validate:
+            error = command.validate(args)
+            if error:
+                return CommandResult(False, error, command.name, command.always_reply)
+
+        ctx = CommandContext(text, args, open_id, user_id)
+        if self.admission is None:
+            result = await command.handler(ctx)
+        else:
+            try:
+                async with self.admission.slot(open_id, command.lane):
+                    result = await command.handler(ctx)
+            except AdmissionRejected:
+                return CommandResult(False, self.busy_message, command.name, command.always_reply)
+        result.command = command.name
+        result.always_reply = result.always_reply or command.always_reply
+        return result
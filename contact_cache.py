@@ -0,0 +1,230 @@
+"""
+通讯录解析缓存模块
+将飞书user_id解析为open_id，带TTL的LRU缓存并缓存查询不到的结果，未命中的请求合并为批量查询
+"""
+import asyncio
+import datetime
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from async_engine import AsyncEngine
+
+
+class ContactCache:
+    def __init__(self, engine: AsyncEngine, token_provider: Callable[[], Awaitable[str]], api_base: str = "https://open.feishu.cn",
+                 max_size: int = 2000, ttl: float = 86400, negative_ttl: float = 600,
+                 batch_window: float = 0.02, batch_size: int = 50):
+        """初始化通讯录缓存
+
+        Args:
+            engine: 异步引擎，用于发起批量查询
+            token_provider: 返回当前tenant_access_token的异步函数（需要时负责刷新）
+            api_base: 飞书开放平台地址
+            max_size: 缓存最大条目数，超出时淘汰最久未使用的条目
+            ttl: 查询成功结果的缓存时间（秒）
+            negative_ttl: 查询不到的结果的缓存时间（秒）
+            batch_window: 合并未命中请求的等待窗口（秒）
+            batch_size: 单次批量查询的最大ID数（接口上限50）
+        """
+        self.engine = engine
+        self.token_provider = token_provider
+        self.api_base = api_base
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+
+        self._lock = threading.Lock()
+        # user_id -> (open_id或None, 过期时间)
+        self._entries: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+        # 等待批量查询的user_id -> Future，只在事件循环线程中访问
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def _store(self, user_id: str, open_id: Optional[str]) -> None:
+        expire_at = time.time() + (self.ttl if open_id else self.negative_ttl)
+        with self._lock:
+            self._entries[user_id] = (open_id, expire_at)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, user_id: str) -> Tuple[bool, Optional[str]]:
+        """查询缓存
+
+        Returns:
+            Tuple[bool, Optional[str]]: (是否命中, open_id)；命中且open_id为None表示已确认查询不到
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return False, None
+            if entry[1] <= time.time():
+                del self._entries[user_id]
+                return False, None
+            self._entries.move_to_end(user_id)
+            return True, entry[0]
+
+    def prime(self, user_id: Optional[str], open_id: Optional[str]) -> None:
+        """写入已知的user_id与open_id对应关系（例如消息事件中同时携带的两种ID）"""
+        if user_id and open_id:
+            self._store(user_id, open_id)
+
+    def snapshot(self) -> List[list]:
+        """导出未过期的缓存条目，按最近使用顺序排列，用于重启前保存状态"""
+        now = time.time()
+        with self._lock:
+            return [[user_id, open_id, expire_at] for user_id, (open_id, expire_at) in self._entries.items()
+                    if expire_at > now]
+
+    def restore(self, entries: Iterable[list]) -> int:
+        """导入snapshot导出的条目，保留原过期时间，已有条目不被覆盖
+
+        Returns:
+            int: 导入的条目数
+        """
+        now = time.time()
+        restored = 0
+        with self._lock:
+            # 从最近使用的条目开始导入，缓存已满时丢弃更旧的条目
+            for user_id, open_id, expire_at in reversed(list(entries)):
+                if len(self._entries) >= self.max_size:
+                    break
+                if expire_at <= now or user_id in self._entries:
+                    continue
+                # 导入的条目比运行中写入的条目更旧，放在淘汰顺序的前面
+                self._entries[user_id] = (open_id, expire_at)
+                self._entries.move_to_end(user_id, last=False)
+                restored += 1
+        return restored
+
+    async def resolve(self, user_id: str) -> Optional[str]:
+        """解析单个user_id，未命中时加入下一次批量查询"""
+        hit, open_id = self.get(user_id)
+        if hit:
+            return open_id
+
+        future = self._pending.get(user_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[user_id] = future
+            if len(self._pending) >= self.batch_size:
+                self._schedule_flush(0)
+            else:
+                self._schedule_flush(self.batch_window)
+        return await asyncio.shield(future)
+
+    async def resolve_many(self, user_ids: Iterable[str]) -> Dict[str, Optional[str]]:
+        """批量解析多个user_id"""
+        unique_ids = list(dict.fromkeys(user_ids))
+        results = await asyncio.gather(*(self.resolve(user_id) for user_id in unique_ids))
+        return dict(zip(unique_ids, results))
+
+    def _schedule_flush(self, delay: float) -> None:
+        if self._flush_handle is not None:
+            if delay > 0:
+                return
+            self._flush_handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._flush_handle = loop.call_later(delay, lambda: asyncio.ensure_future(self._flush()))
+
+    async def _flush(self) -> None:
+        """把等待中的user_id按批次大小拆分并查询"""
+        self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        user_ids = list(pending)
+        for i in range(0, len(user_ids), self.batch_size):
+            batch = user_ids[i:i + self.batch_size]
+            try:
+                resolved = await self._batch_get(batch)
+            except Exception as e:
+                print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][通讯录查询-异常] 批量查询 {len(batch)} 个用户失败: {e}")
+                resolved = None
+
+            for user_id in batch:
+                future = pending[user_id]
+                if future.done():
+                    continue
+                if resolved is None:
+                    # 接口异常不写入缓存，下次重新查询
+                    future.set_result(None)
+                    continue
+                open_id = resolved.get(user_id)
+                self._store(user_id, open_id)
+                future.set_result(open_id)
+
+    async def _batch_get(self, user_ids: List[str]) -> Dict[str, str]:
+        """调用通讯录批量获取用户信息接口
+
+        Returns:
+            Dict[str, str]: 查询到的user_id -> open_id
+        """
+        url = f"{self.api_base}/open-apis/contact/v3/users/batch"
+        params = [("user_id_type", "user_id")] + [("user_ids", user_id) for user_id in user_ids]
+        headers = {"Authorization": f"Bearer {await self.token_provider()}"}
+
+        response = await self.engine.request("GET", url, params=params, headers=headers)
+        if response.status != 200 or response.body.get('code') != 0:
+            raise Exception(f"状态码 {response.status}, 响应: {response.body}")
+
+        items = response.body.get('data', {}).get('items', []) or []
+        return {item['user_id']: item['open_id'] for item in items if item.get('user_id') and item.get('open_id')}
+
+
+if __name__ == "__main__":
+    # 测试代码：LRU淘汰、查询不到的结果的缓存过期、批量合并查询
+    from async_engine import HttpResult
+
+    class _FakeEngine:
+        """模拟通讯录批量接口：只认识known_users中的用户，记录每次查询的user_id"""
+
+        def __init__(self, known_users: Dict[str, str]):
+            self.known_users = known_users
+            self.batches: List[List[str]] = []
+
+        async def request(self, method: str, url: str, params=None, headers=None) -> HttpResult:
+            user_ids = [value for name, value in params if name == "user_ids"]
+            self.batches.append(user_ids)
+            items = [{"user_id": user_id, "open_id": self.known_users[user_id]} for user_id in user_ids if user_id in self.known_users]
+            return HttpResult(200, {"code": 0, "data": {"items": items}}, {})
+
+    async def _token() -> str:
+        return "test_token"
+
+    async def _main() -> None:
+        engine = _FakeEngine({"1001": "ou_1001", "1002": "ou_1002", "1003": "ou_1003"})
+        cache = ContactCache(engine, _token, batch_window=0.01)
+
+        # 同一窗口内的未命中合并为一次查询
+        resolved = await cache.resolve_many(["1001", "1002", "404"])
+        print("批量解析:", resolved, "查询次数:", len(engine.batches))
+        assert resolved == {"1001": "ou_1001", "1002": "ou_1002", "404": None}
+        assert len(engine.batches) == 1
+
+        # 容量为2：访问1001使其变为最近使用，写入1003后淘汰最久未使用的1002
+        cache = ContactCache(engine, _token, max_size=2)
+        cache.prime("1001", "ou_1001")
+        cache.prime("1002", "ou_1002")
+        assert cache.get("1001") == (True, "ou_1001")
+        cache.prime("1003", "ou_1003")
+        print("淘汰后的缓存:", list(cache._entries))
+        assert list(cache._entries) == ["1001", "1003"]
+        assert cache.get("1002") == (False, None)
+
+        # 查询不到的结果在negative_ttl内直接命中，过期后重新查询
+        cache = ContactCache(engine, _token, negative_ttl=0.05, batch_window=0.01)
+        engine.batches.clear()
+        assert await cache.resolve("404") is None
+        assert await cache.resolve("404") is None
+        assert cache.get("404") == (True, None)
+        assert len(engine.batches) == 1
+        await asyncio.sleep(0.06)
+        assert cache.get("404") == (False, None)
+        assert await cache.resolve("404") is None
+        print("查询不到的结果过期前后的查询次数:", len(engine.batches))
+        assert len(engine.batches) == 2
+
+    asyncio.get_event_loop().run_until_complete(_main())
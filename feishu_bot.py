@@ -4,36 +4,145 @@
 """
 import os
 import json
+import asyncio
+import contextvars
 from sys import maxsize
+import aiohttp
 import requests
 import datetime
 import time
 import threading
-from typing import Dict, Any, Optional
+from typing import Callable, Dict, Any, List, Optional
 from dotenv import load_dotenv
 from user_manager import user_manager
+from retry_spool import RetrySpool
+from async_engine import AsyncEngine
+from contact_cache import ContactCache
+from command_router import CommandContext, CommandResult, CommandRouter
+from admission import LANE_SLOW, AdmissionController
+from tracing import ProfileSampler, current_trace, span, traced
+from warm_state import WarmStateStore
+from reconcile import Reconciler, format_report
 
 # 加载环境变量
 load_dotenv()
 
 class FeishuBot:
-    def __init__(self):
-        """初始化飞书机器人"""
+    # 访问令牌距过期不足该秒数时刷新
+    TOKEN_REFRESH_MARGIN = 300
+    
+    def __init__(self, start_background_tasks: bool = True):
+        """初始化飞书机器人
+        
+        Args:
+            start_background_tasks: 是否启动重试队列和过期用户检查等后台任务（压测等一次性任务应传False）
+        """
         self.app_id = os.getenv('FEISHU_APP_ID')
         self.app_secret = os.getenv('FEISHU_APP_SECRET')
         self.verification_token = os.getenv('FEISHU_VERIFICATION_TOKEN')
         self.encrypt_key = os.getenv('FEISHU_ENCRYPT_KEY')
         self.company_id = os.getenv('COMPANY_ID', '15854')
         
-        # 获取访问令牌
-        self.access_token = self._get_access_token()
-        
-        # 启动过期用户检查定时任务
-        self._start_expired_user_check()
+        # 每个操作人名下允许同时存在的成员数上限，0表示不限制
+        self.operator_quota = int(os.getenv('OPERATOR_MEMBER_QUOTA', '0'))
+        
+        # 管理员open_id列表（逗号分隔），可执行性能分析等管理指令
+        self.admin_open_ids = {open_id.strip() for open_id in os.getenv('ADMIN_OPEN_IDS', '').split(',') if open_id.strip()}
+        
+        # 慢指令阈值（毫秒），超过时输出完整链路；按需cProfile采集器
+        self.slow_command_threshold_ms = float(os.getenv('SLOW_COMMAND_THRESHOLD_MS', '3000'))
+        self.profiler = ProfileSampler(os.getenv('PROFILE_OUTPUT_DIR', 'data/profiles'))
+        
+        # 上游接口地址（可指向本地桩服务用于压测）
+        self.miz_api_base = os.getenv('MIZ_API_BASE', 'https://api-go.51miz.com')
+        self.miz_www_base = os.getenv('MIZ_WWW_BASE', 'https://www.51miz.com')
+        self.feishu_api_base = os.getenv('FEISHU_API_BASE', 'https://open.feishu.cn')
+        
+        # HAR文件解析缓存：(文件路径, 修改时间, 解析结果)
+        self._har_cache = None
+        
+        # 异步执行引擎：成员操作流水线都在其事件循环上运行
+        self.engine = AsyncEngine(max_inflight=int(os.getenv('ASYNC_MAX_INFLIGHT', '200')))
+        
+        # 成员操作准入控制：按操作人加权公平排队，限制在途数和速率（格式：open_id:权重，逗号分隔）
+        weights = {}
+        for item in os.getenv('ADMISSION_OPERATOR_WEIGHTS', '').split(','):
+            open_id, _, weight = item.strip().partition(':')
+            if open_id and weight:
+                weights[open_id] = float(weight)
+        self.admission = AdmissionController(
+            max_inflight=int(os.getenv('ADMISSION_MAX_INFLIGHT', '20')),
+            operator_max_inflight=int(os.getenv('ADMISSION_OPERATOR_MAX_INFLIGHT', '2')),
+            operator_rate_per_min=float(os.getenv('ADMISSION_OPERATOR_RATE', '30')),
+            operator_burst=int(os.getenv('ADMISSION_OPERATOR_BURST', '5')),
+            weights=weights,
+            operator_max_queue=int(os.getenv('ADMISSION_OPERATOR_MAX_QUEUE', '20'))
+        )
+        
+        # 指令路由
+        self.router = CommandRouter(admission=self.admission)
+        self._register_commands()
+        
+        # 热重启快照：接管上次关闭时保存的状态（一次性任务不接管，避免执行遗留的指令）
+        self.warm_state = WarmStateStore(
+            state_file=os.getenv('WARM_STATE_FILE', 'data/warm_state.json'),
+            max_age=float(os.getenv('WARM_STATE_MAX_AGE', '3600'))
+        )
+        snapshot = self.warm_state.claim() if start_background_tasks else None
+        
+        # 获取访问令牌：快照中的令牌尚未进入刷新窗口时直接复用，之后由_access_token_async按期刷新
+        if snapshot and snapshot.get('access_token_expire_at', 0) - time.time() > self.TOKEN_REFRESH_MARGIN:
+            self.access_token = snapshot['access_token']
+            self.access_token_expire_at = snapshot['access_token_expire_at']
+        else:
+            self.access_token = self._get_access_token()
+        # 刷新令牌的锁在事件循环中首次刷新时创建
+        self._token_lock: Optional[asyncio.Lock] = None
+        
+        # 通讯录缓存：将user_id解析为open_id，用于多维表格"操作人"字段
+        self.contact_cache = ContactCache(
+            self.engine,
+            self._access_token_async,
+            api_base=self.feishu_api_base,
+            max_size=int(os.getenv('CONTACT_CACHE_SIZE', '2000')),
+            ttl=float(os.getenv('CONTACT_CACHE_TTL', '86400'))
+        )
+        
+        # 快照中未处理完的消息事件，由sdk_connect启动时重新提交
+        self.warm_pending_events = self.restore_warm_state(snapshot) if snapshot else []
+        
+        # 初始化失败操作重试队列（启动时回放磁盘上未完成的记录）
+        self.retry_spool = RetrySpool(
+            spool_file=os.getenv('RETRY_SPOOL_FILE', 'data/retry_spool.log'),
+            max_entries=int(os.getenv('RETRY_SPOOL_MAX_ENTRIES', '1000'))
+        )
+        self.retry_spool.register_handler("delete_member", self._retry_delete_member)
+        self.retry_spool.register_handler("bitable_record", self._retry_bitable_record)
+        
+        # 成员对账：由管理员指令在本进程内触发，与指令处理共用用户数据和重试队列，同一时间只运行一个
+        self.reconciler = Reconciler(
+            self,
+            state_file=os.getenv('RECONCILE_STATE_FILE', 'data/reconcile_state.json'),
+            page_size=int(os.getenv('RECONCILE_PAGE_SIZE', '100')),
+            rate=float(os.getenv('RECONCILE_RATE', '2')),
+            protected_ids={miz_id.strip() for miz_id in os.getenv('RECONCILE_PROTECTED_IDS', '').split(',') if miz_id.strip()},
+            max_pages=int(os.getenv('RECONCILE_MAX_PAGES', '100'))
+        )
+        self._reconcile_task: Optional[asyncio.Future] = None
+        
+        # 后台任务停止标记：关闭时设置，过期用户检查不再开始新的删除
+        self._stop_event = threading.Event()
+        self._expired_check_thread: Optional[threading.Thread] = None
+        
+        if start_background_tasks:
+            self.retry_spool.start()
+            
+            # 启动过期用户检查定时任务
+            self._start_expired_user_check()
     
     def _get_access_token(self) -> str:
         """获取飞书访问令牌"""
-        url = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal/"
+        url = f"{self.feishu_api_base}/open-apis/auth/v3/tenant_access_token/internal/"
         payload = {
             "app_id": self.app_id,
             "app_secret": self.app_secret
@@ -43,15 +152,80 @@ class FeishuBot:
         result = response.json()
         
         if result.get('code') == 0:
+            self.access_token_expire_at = time.time() + result.get('expire', 7200)
             return result['tenant_access_token']
         else:
             raise Exception(f"获取访问令牌失败: {result}")
     
+    async def _access_token_async(self) -> str:
+        """返回当前访问令牌，进入刷新窗口（TOKEN_REFRESH_MARGIN）时先刷新，并发调用只刷新一次
+        
+        刷新失败时返回旧令牌，下次调用继续尝试刷新
+        """
+        if time.time() < self.access_token_expire_at - self.TOKEN_REFRESH_MARGIN:
+            return self.access_token
+        
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            # 等待锁期间其他协程可能已完成刷新
+            if time.time() < self.access_token_expire_at - self.TOKEN_REFRESH_MARGIN:
+                return self.access_token
+            
+            url = f"{self.feishu_api_base}/open-apis/auth/v3/tenant_access_token/internal/"
+            payload = {
+                "app_id": self.app_id,
+                "app_secret": self.app_secret
+            }
+            try:
+                response = await self.engine.request("POST", url, json=payload)
+                result = response.body
+                if result.get('code') == 0:
+                    self.access_token = result['tenant_access_token']
+                    self.access_token_expire_at = time.time() + result.get('expire', 7200)
+                    print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][访问令牌] 已刷新，有效期 {result.get('expire', 7200)} 秒")
+                else:
+                    print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][访问令牌-失败] 刷新访问令牌失败: {result}")
+            except Exception as e:
+                print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][访问令牌-异常] 刷新访问令牌异常: {e}")
+            return self.access_token
+    
+    def save_warm_state(self, pending_events: List[Dict[str, Any]]) -> None:
+        """保存热重启快照
+        
+        Args:
+            pending_events: 尚未处理完的消息事件（与dispatch_event_async的参数格式相同）
+        """
+        contacts = self.contact_cache.snapshot()
+        self.warm_state.save({
+            "access_token": self.access_token,
+            "access_token_expire_at": self.access_token_expire_at,
+            "contacts": contacts,
+            "pending_events": pending_events
+        })
+        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][热重启] 已保存快照 {self.warm_state.state_file}：通讯录缓存 {len(contacts)} 条，未处理指令 {len(pending_events)} 条")
+    
+    def restore_warm_state(self, snapshot: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """从快照恢复通讯录缓存
+        
+        Returns:
+            List[Dict[str, Any]]: 快照中未处理完的消息事件
+        """
+        restored = self.contact_cache.restore(snapshot.get('contacts', []))
+        pending_events = snapshot.get('pending_events', [])
+        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][热重启] 已接管进程 {snapshot.get('pid')} 的快照：通讯录缓存 {restored} 条，未处理指令 {len(pending_events)} 条")
+        return pending_events
+    
     def _extract_cookie_from_har(self, har_file: str, target_url: str) -> Optional[str]:
-        """从HAR文件中提取Cookie"""
+        """从HAR文件中提取Cookie（文件未修改时复用上次的解析结果）"""
         try:
-            with open(har_file, "r", encoding="utf-8-sig") as f:  # ✅ 兼容 BOM
-                har_data = json.load(f)
+            mod_time = os.path.getmtime(har_file)
+            if self._har_cache and self._har_cache[0] == har_file and self._har_cache[1] == mod_time:
+                har_data = self._har_cache[2]
+            else:
+                with open(har_file, "r", encoding="utf-8-sig") as f:  # ✅ 兼容 BOM
+                    har_data = json.load(f)
+                self._har_cache = (har_file, mod_time, har_data)
         except FileNotFoundError:
             print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][错误] 找不到HAR文件 {har_file}")
             return None
@@ -77,22 +251,46 @@ class FeishuBot:
         return candidate_cookie
     
     def add_member(self, miz_id: str, open_id: str = None, retry_count: int = 0) -> Dict[str, Any]:
-        """添加成员到觅智网，支持Cookie过期自动重试"""
+        """添加成员到觅智网（同步接口，在异步引擎上执行add_member_async）"""
+        return self.engine.run(self.add_member_async(miz_id, open_id, retry_count))
+    
+    def delete_member(self, miz_id: str, open_id: str = None, retry_count: int = 0) -> Dict[str, Any]:
+        """从觅智网删除成员（同步接口，在异步引擎上执行delete_member_async）"""
+        return self.engine.run(self.delete_member_async(miz_id, open_id, retry_count))
+    
+    @traced("add_member")
+    async def add_member_async(self, miz_id: str, open_id: str = None, retry_count: int = 0, check_local: bool = True) -> Dict[str, Any]:
+        """添加成员到觅智网，支持Cookie过期自动重试
+        
+        check_local为False时跳过24小时重复添加和配额检查，用于对账时补回本地有效但企业中缺失的成员
+        """
         # 验证用户ID
         if not self._validate_userid(miz_id):
             return {"success": False, "message": "无效的用户ID，必须为5-20位纯数字"}
         
-        # 检查用户是否在24小时内已添加过
-        if not user_manager.can_add_user(miz_id):
-            return {"success": False, "message": "该用户24小时内已添加过，请等待有效期结束后再添加"}
-        
+        # 原子地检查24小时重复添加和操作人配额并预占名额，避免同一操作人的并发添加超出配额
+        if check_local:
+            error = user_manager.reserve_user(miz_id, open_id, self.operator_quota)
+            if error:
+                return {"success": False, "message": error}
+            try:
+                return await self._add_member_upstream_async(miz_id, open_id, retry_count)
+            finally:
+                # 添加成功时名额已转为正式记录，失败时释放
+                user_manager.release_user(miz_id)
+        
+        return await self._add_member_upstream_async(miz_id, open_id, retry_count)
+    
+    async def _add_member_upstream_async(self, miz_id: str, open_id: str = None, retry_count: int = 0) -> Dict[str, Any]:
+        """调用觅智网接口添加成员，成功后写入本地记录，Cookie过期时重试一次"""
         har_file = os.getenv('HAR_FILE', 'data/cookie.har')
-        cookies = self._extract_cookie_from_har(har_file, "/v1/company/addMember")
+        with span("cookie_extract"):
+            cookies = await self.engine.run_blocking(self._extract_cookie_from_har, har_file, "/v1/company/addMember")
         
         if not cookies:
             return {"success": False, "message": "无法获取Cookie"}
         
-        url = "https://api-go.51miz.com/v1/company/addMember"
+        url = f"{self.miz_api_base}/v1/company/addMember"
         
         headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/139.0.0.0 Safari/537.36 Edg/139.0.0.0",
@@ -101,57 +299,60 @@ class FeishuBot:
             "Cookie": cookies
         }
 
-        files = {
-            "userid": (None, miz_id),
-            "companyid": (None, self.company_id),
+        fields = {
+            "userid": miz_id,
+            "companyid": self.company_id,
         }
 
         try:
-            response = requests.post(url, headers=headers, files=files)
-            result = response.json()
+            with span("miz_add_member", miz_id=miz_id):
+                response = await self.engine.post_multipart(url, fields, headers=headers)
+            result = response.body
             
             # 打印响应内容用于调试
-            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][添加成员响应状态码] {response.status_code}")
+            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][添加成员响应状态码] {response.status}")
             print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][添加成员响应内容] {result}")
             
             # 检查Cookie是否过期（401错误）
-            if response.status_code == 401 or result.get('code') == 401:
+            if response.status == 401 or result.get('code') == 401:
                 if retry_count < 1:  # 最多重试1次
                     print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][错误] Cookie已过期，尝试重新获取Cookie并重试...")
                     # 清除可能的缓存并重试
-                    return self.add_member(miz_id, open_id, retry_count + 1)
+                    return await self._add_member_upstream_async(miz_id, open_id, retry_count + 1)
                 else:
-                    self._sync_to_bitable(open_id, "add", "failed", "Cookie已过期，请更新HAR文件", miz_id)
+                    await self._sync_to_bitable_async(open_id, "add", "failed", "Cookie已过期，请更新HAR文件", miz_id)
                     return {"success": False, "message": "Cookie已过期，请更新HAR文件后重试"}
             
             # 同步到多维表格
-            if response.status_code == 200 and result.get('code') == 200:
-                # 记录用户添加时间
-                user_manager.add_user(miz_id, open_id)
-                self._sync_to_bitable(open_id, "add", "success", result.get('msg', ''), miz_id)
+            if response.status == 200 and result.get('code') == 200:
+                # 记录用户添加时间（写文件在线程池中执行）
+                await self.engine.run_blocking(user_manager.add_user, miz_id, open_id)
+                await self._sync_to_bitable_async(open_id, "add", "success", result.get('msg', ''), miz_id)
                 return {"success": True, "message": "添加成员成功"}
             else:
                 error_msg = result.get('msg', '添加成员失败')
-                self._sync_to_bitable(open_id, "add", "failed", error_msg, miz_id)
+                await self._sync_to_bitable_async(open_id, "add", "failed", error_msg, miz_id)
                 return {"success": False, "message": error_msg}
                 
         except Exception as e:
-            self._sync_to_bitable(open_id, "add", "error", str(e), miz_id)
+            await self._sync_to_bitable_async(open_id, "add", "error", str(e), miz_id)
             return {"success": False, "message": f"请求异常: {e}"}
     
-    def delete_member(self, miz_id: str, open_id: str = None, retry_count: int = 0) -> Dict[str, Any]:
+    @traced("delete_member")
+    async def delete_member_async(self, miz_id: str, open_id: str = None, retry_count: int = 0) -> Dict[str, Any]:
         """从觅智网删除成员，支持Cookie过期自动重试"""
         # 验证用户ID
         if not self._validate_userid(miz_id):
             return {"success": False, "message": "无效的用户ID，必须为5-20位纯数字"}
         
         har_file = os.getenv('HAR_FILE', 'data/cookie.har')
-        cookies = self._extract_cookie_from_har(har_file, "OutCompany&a=DelCompanyMember")
+        with span("cookie_extract"):
+            cookies = await self.engine.run_blocking(self._extract_cookie_from_har, har_file, "OutCompany&a=DelCompanyMember")
         
         if not cookies:
             return {"success": False, "message": "无法获取Cookie"}
         
-        url = "https://www.51miz.com/?m=OutCompany&a=DelCompanyMember&ajax=1"
+        url = f"{self.miz_www_base}/?m=OutCompany&a=DelCompanyMember&ajax=1"
         
         headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/139.0.0.0 Safari/537.36 Edg/139.0.0.0",
@@ -167,39 +368,92 @@ class FeishuBot:
         }
 
         try:
-            response = requests.post(url, headers=headers, data=data)
-            result = response.json()
+            with span("miz_delete_member", miz_id=miz_id):
+                response = await self.engine.request("POST", url, headers=headers, data=data)
+            result = response.body
             
             # 打印响应内容用于调试
-            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][删除成员响应状态码] {response.status_code}")
+            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][删除成员响应状态码] {response.status}")
             print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][删除成员响应内容] {result}")
             
             # 检查Cookie是否过期（401错误）
-            if response.status_code == 401 or result.get('code') == 401:
+            if response.status == 401 or result.get('code') == 401:
                 if retry_count < 1:  # 最多重试1次
                     print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][错误] Cookie已过期，尝试重新获取Cookie并重试...")
                     # 清除可能的缓存并重试
-                    return self.delete_member(miz_id, open_id, retry_count + 1)
+                    return await self.delete_member_async(miz_id, open_id, retry_count + 1)
                 else:
-                    self._sync_to_bitable(open_id, "delete", "failed", "Cookie已过期，请更新HAR文件", miz_id)
+                    await self._sync_to_bitable_async(open_id, "delete", "failed", "Cookie已过期，请更新HAR文件", miz_id)
                     return {"success": False, "message": "Cookie已过期，请更新HAR文件后重试"}
             
             # 同步到多维表格
-            if response.status_code == 200 and result.get('status') == 200:
-                self._sync_to_bitable(open_id, "delete", "success", result.get('msg', ''), miz_id)
-                # 从用户管理器中移除已删除的用户
-                user_manager.remove_user(miz_id)
+            if response.status == 200 and result.get('status') == 200:
+                await self._sync_to_bitable_async(open_id, "delete", "success", result.get('msg', ''), miz_id)
+                # 从用户管理器中移除已删除的用户（写文件在线程池中执行）
+                await self.engine.run_blocking(user_manager.remove_user, miz_id)
                 return {"success": True, "message": "删除成员成功"}
             else:
                 error_msg = result.get('msg', '删除成员失败')
-                self._sync_to_bitable(open_id, "delete", "failed", error_msg, miz_id)
+                await self._sync_to_bitable_async(open_id, "delete", "failed", error_msg, miz_id)
                 return {"success": False, "message": error_msg}
                 
         except Exception as e:
-            self._sync_to_bitable(open_id, "delete", "error", str(e), miz_id)
+            await self._sync_to_bitable_async(open_id, "delete", "error", str(e), miz_id)
             print(f"删除成员失败: {e}")
             return {"success": False, "message": f"请求异常: {e}"}
     
+    async def fetch_company_members_async(self, page: int, page_size: int) -> Dict[str, Any]:
+        """分页读取觅智网企业成员列表
+        
+        Args:
+            page: 页码（从1开始）
+            page_size: 每页条数
+            
+        Returns:
+            Dict[str, Any]: 成功时包含members（miz_id列表）和total（总数，接口未返回时为None）
+        """
+        har_file = os.getenv('HAR_FILE', 'data/cookie.har')
+        cookies = await self.engine.run_blocking(self._extract_cookie_from_har, har_file, "OutCompany&a=CompanyMemberList")
+        
+        if not cookies:
+            return {"success": False, "message": "无法获取Cookie"}
+        
+        # .env中留空时load_dotenv会设置为空字符串，同样使用默认地址
+        url = os.getenv('MIZ_MEMBER_LIST_URL') or f"{self.miz_www_base}/?m=OutCompany&a=CompanyMemberList&ajax=1"
+        
+        headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/139.0.0.0 Safari/537.36 Edg/139.0.0.0",
+            "Origin": "https://www.51miz.com",
+            "Referer": "https://www.51miz.com/?m=home&a=company_vip",
+            "Cookie": cookies,
+            "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8"
+        }
+        
+        data = {
+            "company_id": self.company_id,
+            "page": page,
+            "pagesize": page_size,
+        }
+        
+        try:
+            response = await self.engine.request("POST", url, headers=headers, data=data)
+            result = response.body
+            
+            if response.status == 401 or result.get('code') == 401 or result.get('status') == 401:
+                return {"success": False, "message": "Cookie已过期，请更新HAR文件后重试"}
+            
+            if response.status != 200 or result.get('status', result.get('code')) != 200:
+                return {"success": False, "message": result.get('msg', '读取企业成员列表失败')}
+            
+            payload = result.get('data') or {}
+            items = payload.get('list', []) if isinstance(payload, dict) else payload
+            members = [str(item.get('userid') or item.get('user_id')) for item in items if item.get('userid') or item.get('user_id')]
+            total = payload.get('total') if isinstance(payload, dict) else None
+            return {"success": True, "members": members, "total": int(total) if total is not None else None}
+            
+        except Exception as e:
+            return {"success": False, "message": f"请求异常: {e}"}
+    
     def _validate_userid(self, miz_id: str) -> bool:
         """验证用户ID是否为纯数字且长度合理（5-20位）
         
@@ -222,11 +476,11 @@ class FeishuBot:
         
         return True
     
-    def _get_valid_user_id(self, open_id: str) -> Optional[str]:
+    async def _get_valid_user_id_async(self, open_id: str) -> Optional[str]:
         """获取有效的用户ID格式（根据多维表格字段配置）
         
-        检查传入的ID格式，如果是user_id格式（纯数字），则返回None（不处理转换）
-        如果是open_id格式（以ou_开头），则直接返回
+        检查传入的ID格式，如果是open_id格式（以ou_开头），则直接返回
+        如果是user_id格式（纯数字），则通过通讯录缓存解析为open_id，解析不到时返回None
         """
         if not open_id:
             return None
@@ -235,15 +489,23 @@ class FeishuBot:
         if open_id.startswith('ou_'):
             return open_id
         
-        # 如果是纯数字（user_id格式），返回None，因为无法转换为open_id
+        # 如果是纯数字（user_id格式），通过通讯录缓存转换为open_id
         if open_id.isdigit():
-            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][警告] 传入的是user_id格式 '{open_id}'，无法转换为open_id格式，跳过人员字段")
-            return None
+            with span("contact_resolve"):
+                resolved = await self.contact_cache.resolve(open_id)
+            if not resolved:
+                print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][警告] 传入的是user_id格式 '{open_id}'，通讯录中查询不到对应的open_id，跳过人员字段")
+            return resolved
         
         # 其他格式直接返回
         return open_id
     
     def _sync_to_bitable(self, open_id: str, action: str, status: str, message: str, miz_id: str = '') -> None:
+        """同步操作记录到飞书多维表格（同步接口）"""
+        self.engine.run(self._sync_to_bitable_async(open_id, action, status, message, miz_id))
+    
+    @traced("sync_to_bitable")
+    async def _sync_to_bitable_async(self, open_id: str, action: str, status: str, message: str, miz_id: str = '') -> None:
         """同步操作记录到飞书多维表格"""
         print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][同步到多维表格-成功] 该操作执行用户OpenID：{open_id}")
         
@@ -257,14 +519,7 @@ class FeishuBot:
         
         try:
             # 获取有效的用户ID格式
-            valid_user_id = self._get_valid_user_id(open_id)
-            
-            # 构建多维表格API请求（明确指定user_id_type为open_id）
-            bitable_url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records?user_id_type=open_id"
-            headers = {
-                "Authorization": f"Bearer {self.access_token}",
-                "Content-Type": "application/json"
-            }
+            valid_user_id = await self._get_valid_user_id_async(open_id)
             
             # 获取当前时间（Unix时间戳格式，毫秒级）
             current_time = int(datetime.datetime.now().timestamp() * 1000)
@@ -281,53 +536,166 @@ class FeishuBot:
                 }
             }
             
-            # 发送请求到多维表格
-            response = requests.post(bitable_url, headers=headers, json=data, timeout=10)
-            result = response.json()
+            # 发送请求到多维表格，失败时写入重试队列（追加写和fsync在线程池中执行）
+            if not await self._post_bitable_record_async(data):
+                await self.engine.run_blocking(self.retry_spool.enqueue, "bitable_record", {"data": data})
+                
+        except Exception as e:
+            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][同步到多维表格-异常] 多维表格同步异常: {e}")
+    
+    async def _post_bitable_record_async(self, data: Dict[str, Any]) -> bool:
+        """发送一条记录到多维表格
+
+        Args:
+            data: 多维表格记录请求体
+
+        Returns:
+            bool: 是否写入成功
+        """
+        app_token = os.getenv('BITABLE_APP_TOKEN')
+        table_id = os.getenv('BITABLE_TABLE_ID')
+        bitable_url = f"{self.feishu_api_base}/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records?user_id_type=open_id"
+        headers = {
+            "Authorization": f"Bearer {await self._access_token_async()}",
+            "Content-Type": "application/json"
+        }
+        
+        try:
+            response = await self.engine.request("POST", bitable_url, headers=headers, json=data)
+            result = response.body
             
-            if response.status_code == 200 and result.get('code') == 0:
+            if response.status == 200 and result.get('code') == 0:
                 print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][同步到多维表格-成功] 多维表格同步成功: {{'事件记录': '{result.get('data', {}).get('record', {}).get('fields', {}).get('事件记录', '')}', 'record_id': '{result.get('data', {}).get('record', {}).get('record_id', '')}'}}")
-            else:
-                print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][同步到多维表格-失败] 多维表格同步失败: 状态码 {response.status_code}, 响应: {result}")
+                return True
+            
+            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][同步到多维表格-失败] 多维表格同步失败: 状态码 {response.status}, 响应: {result}")
+            return False
                 
-        except requests.exceptions.RequestException as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][同步到多维表格-网络错误] 多维表格同步网络错误: {e}")
+            return False
         except Exception as e:
             print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][同步到多维表格-异常] 多维表格同步异常: {e}")
+            return False
+    
+    def _retry_bitable_record(self, payload: Dict[str, Any]) -> bool:
+        """重试队列回调：重新发送未写入的多维表格记录"""
+        if not os.getenv('BITABLE_APP_TOKEN') or not os.getenv('BITABLE_TABLE_ID'):
+            return True
+        return self.engine.run(self._post_bitable_record_async(payload['data']))
+    
+    def _retry_delete_member(self, payload: Dict[str, Any]) -> bool:
+        """重试队列回调：重新删除过期用户
+        
+        如果用户已被移除或在此期间被重新添加（未过期），则视为无需再删除
+        """
+        miz_id = payload['miz_id']
+        if not user_manager.get_user_info(miz_id) or not user_manager.can_add_user(miz_id):
+            return True
+        return bool(self.delete_member(miz_id, payload.get('open_id')).get('success'))
+    
+    @traced("send_reply")
+    async def send_reply_async(self, open_id: str, text: str) -> Dict[str, Any]:
+        """向用户发送文本消息
+        
+        Args:
+            open_id: 接收消息的飞书用户open_id
+            text: 消息文本
+            
+        Returns:
+            Dict[str, Any]: 发送结果，失败时包含原因和LogID
+        """
+        url = f"{self.feishu_api_base}/open-apis/im/v1/messages?receive_id_type=open_id"
+        headers = {
+            "Authorization": f"Bearer {await self._access_token_async()}",
+            "Content-Type": "application/json"
+        }
+        data = {
+            "receive_id": open_id,
+            "msg_type": "text",
+            "content": json.dumps({"text": text}, ensure_ascii=False)
+        }
+        
+        try:
+            response = await self.engine.request("POST", url, headers=headers, json=data)
+            if response.status == 200 and response.body.get('code') == 0:
+                return {"success": True, "message": "发送成功"}
+            return {"success": False, "message": response.body.get('msg', f"状态码 {response.status}"), "log_id": response.headers.get('X-Tt-Logid', 'N/A')}
+        except Exception as e:
+            return {"success": False, "message": str(e), "log_id": getattr(e, 'log_id', 'N/A')}
     
     def _start_expired_user_check(self):
         """启动过期用户检查定时任务"""
         def check_expired_users():
-            while True:
+            while not self._stop_event.is_set():
                 try:
                     # 获取所有过期用户
                     expired_users = user_manager.get_expired_users()
                     
                     for userid in expired_users:
+                        # 正在关闭时不再开始新的删除
+                        if self._stop_event.is_set():
+                            break
+                        
+                        # 删除操作已在重试队列中等待的用户交给重试队列处理，避免重复调用删除接口
+                        if self.retry_spool.has_key(f"delete:{userid}"):
+                            continue
+                        
+                        # 以添加该用户的操作人作为删除记录的操作人
+                        operator_id = (user_manager.get_user_info(userid) or {}).get('open_id')
                         try:
                             # 自动删除过期用户
-                            result = self.delete_member(userid)
+                            # 删除成功时delete_member_async已从用户管理器中移除该用户
+                            result = self.delete_member(userid, operator_id)
                             if result.get("success"):
                                 print(f"自动删除过期用户 {userid} 成功")
-                                # 从用户管理器中移除
-                                user_manager.remove_user(userid)
                             else:
-                                print(f"自动删除过期用户 {userid} 失败: {result.get('message')}")
+                                print(f"自动删除过期用户 {userid} 失败: {result.get('message')}，已加入重试队列")
+                                self.retry_spool.enqueue("delete_member", {"miz_id": userid, "open_id": operator_id}, key=f"delete:{userid}")
                         except Exception as e:
-                            print(f"删除过期用户 {userid} 时发生错误: {str(e)}")
+                            print(f"删除过期用户 {userid} 时发生错误: {str(e)}，已加入重试队列")
+                            self.retry_spool.enqueue("delete_member", {"miz_id": userid, "open_id": operator_id}, key=f"delete:{userid}")
                     
-                    # 每小时检查一次
-                    time.sleep(3600)
+                    metrics = self.retry_spool.get_metrics()
+                    print(f"重试队列状态: 待重试 {metrics['pending']} 条，累计完成 {metrics['drained_total']} 条，排空速率 {metrics['drain_rate_per_min']:.2f} 条/分钟")
+                    
+                    # 每小时检查一次（关闭时立即结束等待）
+                    self._stop_event.wait(3600)
                     
                 except Exception as e:
                     print(f"过期用户检查任务发生错误: {str(e)}")
-                    time.sleep(300)  # 5分钟后重试
+                    self._stop_event.wait(300)  # 5分钟后重试
         
         # 启动后台线程
-        thread = threading.Thread(target=check_expired_users, daemon=True)
-        thread.start()
+        self._expired_check_thread = threading.Thread(target=check_expired_users, name="expired-user-check", daemon=True)
+        self._expired_check_thread.start()
         print("过期用户检查定时任务已启动")
     
+    def stop_background_tasks(self, timeout: float) -> bool:
+        """停止过期用户检查、重试队列和成员对账，等待进行中的操作完成，必须在停止异步引擎之前调用
+        
+        Args:
+            timeout: 最长等待时间（秒）
+            
+        Returns:
+            bool: 是否全部在期限内停止
+        """
+        self._stop_event.set()
+        deadline = time.monotonic() + timeout
+        stopped = self.retry_spool.stop(timeout)
+        
+        if self._expired_check_thread is not None:
+            self._expired_check_thread.join(max(0.0, deadline - time.monotonic()))
+            stopped = stopped and not self._expired_check_thread.is_alive()
+        
+        task = self._reconcile_task
+        if task is not None and not task.done():
+            self.reconciler.request_stop()
+            remaining = max(0.0, deadline - time.monotonic())
+            self.engine.run(asyncio.wait([task], timeout=remaining))
+            stopped = stopped and task.done()
+        return stopped
+    
     def check_cookie_status(self) -> Dict[str, Any]:
         """检查Cookie有效性状态
         
@@ -357,62 +725,217 @@ class FeishuBot:
             "next_check_time": current_time + 3600  # 1小时后再次检查
         }
     
+    @staticmethod
+    def _format_remaining(remaining_time: float) -> str:
+        """将剩余秒数格式化为X小时Y分钟"""
+        remaining_hours = int(remaining_time // 3600)
+        remaining_minutes = int((remaining_time % 3600) // 60)
+        return f"{remaining_hours}小时{remaining_minutes}分钟"
+    
+    def _format_member_line(self, miz_id: str) -> str:
+        """格式化成员列表中的一行"""
+        user_info = user_manager.get_user_info(miz_id) or {}
+        remaining_time = user_info.get('expire_time', 0) - time.time()
+        if remaining_time <= 0:
+            return f"• {miz_id} - 已过期，等待删除"
+        return f"• {miz_id} - 剩余{self._format_remaining(remaining_time)}"
+    
     def handle_message(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """处理飞书消息事件（同步接口，在异步引擎上执行handle_message_async）"""
+        return self.engine.run(self.handle_message_async(event))
+    
+    async def handle_message_async(self, event: Dict[str, Any]) -> Dict[str, Any]:
         """处理飞书消息事件"""
-        message_content = event.get('event', {}).get('message', {}).get('content', '')
+        result = await self.dispatch_event_async(event)
+        return result.to_dict()
+    
+    async def dispatch_event_async(self, event: Dict[str, Any]) -> CommandResult:
+        """解析飞书消息事件并分发到对应指令
+        
+        Returns:
+            CommandResult: 指令处理结果，reply_text为需要回复给用户的文本
+        """
+        event_body = event.get('event', {})
+        sender_id = event_body.get('sender', {}).get('sender_id', {})
+        text = self.router.parse_content(event_body.get('message', {}).get('content', ''))
+        result = await self.router.dispatch(text, sender_id.get('open_id'), sender_id.get('user_id'))
+        
+        trace = current_trace()
+        if trace is not None:
+            trace.attrs['command'] = result.command
+        return result
+    
+    def _register_commands(self) -> None:
+        """注册机器人支持的指令，帮助信息按注册顺序生成"""
+        def validate_userid(action: str) -> Callable[[list], Optional[str]]:
+            def validate(args: list) -> Optional[str]:
+                if not self._validate_userid(args[0]):
+                    return f"{action}用户 {args[0]} 失败，原因：无效的用户ID，必须为5-20位纯数字"
+                return None
+            return validate
+        
+        def validate_hours(args: list) -> Optional[str]:
+            # 成员有效期为24小时，更长的范围没有意义；inf、nan等非有限值同样拒绝
+            try:
+                if args and not 0 < float(args[0]) <= 24:
+                    raise ValueError
+            except ValueError:
+                return "请输入0-24之间的小时数，格式：即将过期 [小时]"
+            return None
         
+        def validate_reconcile_options(args: list) -> Optional[str]:
+            if any(arg not in ("预览", "增量", "清理") for arg in args):
+                return "可选参数为 预览、增量、清理，格式：成员对账 [预览] [增量] [清理]"
+            return None
+        
+        def validate_count(args: list) -> Optional[str]:
+            if not args[0].isdigit() or not 0 <= int(args[0]) <= 1000:
+                return "请输入0-1000之间的条数，格式：性能分析 [条数]"
+            return None
+        
+        self.router.register("添加成员", self._cmd_add_member, min_args=1, max_args=1, usage="添加成员 [userid]",
+                             description="添加成员到企业（一次授权仅允许使用24小时，期间不允许重复添加）",
+                             validate=validate_userid("添加"), always_reply=True, lane=LANE_SLOW)
+        self.router.register("删除成员", self._cmd_delete_member, min_args=1, max_args=1, usage="删除成员 [userid]",
+                             description="从企业删除成员", validate=validate_userid("删除"), always_reply=True,
+                             lane=LANE_SLOW)
+        self.router.register("Cookie状态", self._cmd_cookie_status, aliases=("cookie状态", "cookie"),
+                             description="检查Cookie有效性状态")
+        self.router.register("用户状态", self._cmd_user_status, min_args=1, max_args=1, usage="用户状态 [userid]",
+                             description="查看用户有效期状态")
+        self.router.register("我的成员", self._cmd_my_members, description="查看自己添加的成员及剩余有效期")
+        self.router.register("即将过期", self._cmd_expiring, max_args=1, usage="即将过期 [小时]",
+                             description="查看将在指定小时内过期的成员（默认1小时，最多24小时）", validate=validate_hours)
+        self.router.register("性能分析", self._cmd_profile, min_args=1, max_args=1, usage="性能分析 [条数]",
+                             description="（管理员）对接下来的指令采集cProfile", validate=validate_count,
+                             always_reply=True)
+        self.router.register("运行指标", self._cmd_metrics, description="（管理员）查看指令排队等待时间和重试队列状态",
+                             always_reply=True)
+        self.router.register("成员对账", self._cmd_reconcile, max_args=3, usage="成员对账 [预览] [增量] [清理]",
+                             description="（管理员）比对本地记录与企业成员名单并纠正，完成后发送报告",
+                             validate=validate_reconcile_options, always_reply=True)
+        self.router.register("使用帮助", self._cmd_help, aliases=("帮助", "help"), description="显示帮助信息")
+    
+    async def _cmd_add_member(self, ctx: CommandContext) -> CommandResult:
+        miz_id = ctx.args[0]
+        result = await self.add_member_async(miz_id, ctx.open_id)
+        if result.get('success'):
+            return CommandResult(True, f"添加用户 {miz_id} 成功")
+        return CommandResult(False, f"添加用户 {miz_id} 失败，原因：{result.get('message', '未知错误')}")
+    
+    async def _cmd_delete_member(self, ctx: CommandContext) -> CommandResult:
+        miz_id = ctx.args[0]
+        result = await self.delete_member_async(miz_id, ctx.open_id)
+        if result.get('success'):
+            return CommandResult(True, f"删除用户 {miz_id} 成功")
+        return CommandResult(False, f"删除用户 {miz_id} 失败，原因：{result.get('message', '未知错误')}")
+    
+    async def _cmd_profile(self, ctx: CommandContext) -> CommandResult:
+        if ctx.open_id not in self.admin_open_ids:
+            return CommandResult(False, "无权限执行该指令")
+        
+        count = int(ctx.args[0])
+        self.profiler.arm(count)
+        if count == 0:
+            return CommandResult(True, "已关闭性能分析")
+        return CommandResult(True, f"已开启性能分析，将采集接下来 {count} 条指令，结果写入 {self.profiler.output_dir}")
+    
+    async def _cmd_metrics(self, ctx: CommandContext) -> CommandResult:
+        if ctx.open_id not in self.admin_open_ids:
+            return CommandResult(False, "无权限执行该指令")
+        
+        admission = self.admission.get_metrics()
+        lane_names = {"fast": "快速通道", "slow": "成员操作"}
+        lines = [f"📊 运行指标\n成员操作在途 {admission['inflight']}，排队 {admission['queued']}，排队已满拒绝 {admission['rejected']}"]
+        for lane, stats in admission['lanes'].items():
+            lines.append(f"{lane_names.get(lane, lane)}: {stats['count']} 次，平均等待 {stats['avg_ms']:.0f}ms，最长等待 {stats['max_ms']:.0f}ms")
+        
+        # 只列出等待最久的操作人
+        operators = sorted(admission['operators'].items(), key=lambda item: -item[1]['max_ms'])[:10]
+        if operators:
+            lines.append("操作人等待:")
+            for open_id, stats in operators:
+                lines.append(f"• {open_id}: {stats['count']} 次，平均 {stats['avg_ms']:.0f}ms，最长 {stats['max_ms']:.0f}ms，在途 {stats['inflight']}，排队 {stats['queued']}，拒绝 {stats['rejected']}")
+        
+        spool = self.retry_spool.get_metrics()
+        lines.append(f"重试队列: 待处理 {spool['pending']}，已完成 {spool['drained_total']}，已丢弃 {spool['dropped_total']}，速率 {spool['drain_rate_per_min']:.1f}/分钟")
+        return CommandResult(True, "\n".join(lines))
+    
+    async def _cmd_reconcile(self, ctx: CommandContext) -> CommandResult:
+        if ctx.open_id not in self.admin_open_ids:
+            return CommandResult(False, "无权限执行该指令")
+        if self._reconcile_task is not None and not self._reconcile_task.done():
+            return CommandResult(False, "成员对账正在进行中，请等待报告后再试")
+        
+        options = set(ctx.args)
+        coro = self._run_reconcile(ctx.open_id, "预览" in options, "增量" in options, "清理" in options)
+        # 在空白上下文中创建任务，不挂到本条指令的链路上（指令回复后链路即结束）
+        self._reconcile_task = contextvars.Context().run(asyncio.ensure_future, coro)
+        return CommandResult(True, "已开始成员对账，完成后将发送对账报告")
+    
+    async def _run_reconcile(self, open_id: str, dry_run: bool, incremental: bool, remove_orphans: bool) -> None:
+        """执行对账并把报告回复给发起的管理员"""
         try:
-            # 解析消息内容
-            content_json = json.loads(message_content)
-            text = content_json.get('text', '').strip()
-        except:
-            text = message_content.strip()
-        
-        # 解析指令
-        # 注意：添加成员和删除成员指令现在在sdk_connect.py中直接处理
-        # 这里只处理其他指令，避免重复处理
-        if text.startswith("添加成员") or text.startswith("删除成员"):
-            # 这些指令已经在sdk_connect.py中处理，这里返回提示信息
-            return {"success": False, "message": "指令正在处理中，请稍候..."}
-        
-        elif text in ["使用帮助", "帮助", "help"]:
-            help_text = """可用指令:\n• 添加成员 [userid] - 添加成员到企业（一次授权仅允许使用24小时，期间不允许重复添加）\n• 删除成员 [userid] - 从企业删除成员\n• Cookie状态 - 检查Cookie有效性状态\n• 用户状态 [userid] - 查看用户有效期状态\n• 使用帮助 - 显示帮助信息"""
-            return {"success": True, "message": help_text}
-        
-        elif text in ["Cookie状态", "cookie状态", "cookie"]:
-            status = self.check_cookie_status()
-            status_text = f"🍪 Cookie状态检查\n有效性: {'✅ 有效' if status['is_valid'] else '❌ 无效'}\n上次检查: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(status['last_check_time']))}\n下次检查: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(status['next_check_time']))}"
-            return {"success": True, "message": status_text}
-        
-        elif text.startswith("用户状态"):
-            # 处理用户状态查询指令
-            parts = text.split()
-            if len(parts) < 2:
-                return {"success": False, "message": "请输入用户ID，格式：用户状态 [userid]"}
-            
-            miz_id = parts[1]
-            user_info = user_manager.get_user_info(miz_id)
-            
-            if not user_info:
-                return {"success": True, "message": f"用户 {miz_id} 未找到或已过期"}
-            
-            add_time = user_info.get('add_time', 0)
-            expire_time = user_info.get('expire_time', 0)
-            current_time = time.time()
-            
-            # 计算剩余时间
-            remaining_time = expire_time - current_time
-            if remaining_time <= 0:
-                return {"success": True, "message": f"用户 {miz_id} 已过期"}
-            
-            # 格式化时间显示
-            add_time_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(add_time))
-            expire_time_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(expire_time))
-            remaining_hours = int(remaining_time // 3600)
-            remaining_minutes = int((remaining_time % 3600) // 60)
-            
-            status_text = f"👤 用户状态查询\n用户ID: {miz_id}\n添加时间: {add_time_str}\n过期时间: {expire_time_str}\n剩余有效期: {remaining_hours}小时{remaining_minutes}分钟"
-            return {"success": True, "message": status_text}
+            report = await self.reconciler.run_async(dry_run, incremental, remove_orphans)
+            text = format_report(report)
+        except Exception as e:
+            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][成员对账] 对账失败: {e}")
+            text = f"成员对账失败，原因：{e}"
+        await self.send_reply_async(open_id, text)
+    
+    async def _cmd_help(self, ctx: CommandContext) -> CommandResult:
+        lines = ["可用指令:"]
+        lines.extend(f"• {command.usage} - {command.description}" for command in self.router.commands)
+        return CommandResult(True, "\n".join(lines))
+    
+    async def _cmd_cookie_status(self, ctx: CommandContext) -> CommandResult:
+        status = self.check_cookie_status()
+        status_text = f"🍪 Cookie状态检查\n有效性: {'✅ 有效' if status['is_valid'] else '❌ 无效'}\n上次检查: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(status['last_check_time']))}\n下次检查: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(status['next_check_time']))}"
+        return CommandResult(True, status_text)
+    
+    async def _cmd_user_status(self, ctx: CommandContext) -> CommandResult:
+        miz_id = ctx.args[0]
+        user_info = user_manager.get_user_info(miz_id)
         
-        else:
-            return {"success": False, "message": "未知指令，请输入'帮助'查看可用指令"}
\ No newline at end of file
+        if not user_info:
+            return CommandResult(True, f"用户 {miz_id} 未找到或已过期")
+        
+        add_time = user_info.get('add_time', 0)
+        expire_time = user_info.get('expire_time', 0)
+        current_time = time.time()
+        
+        # 计算剩余时间
+        remaining_time = expire_time - current_time
+        if remaining_time <= 0:
+            return CommandResult(True, f"用户 {miz_id} 已过期")
+        
+        # 格式化时间显示
+        add_time_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(add_time))
+        expire_time_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(expire_time))
+        
+        status_text = f"👤 用户状态查询\n用户ID: {miz_id}\n添加时间: {add_time_str}\n过期时间: {expire_time_str}\n剩余有效期: {self._format_remaining(remaining_time)}"
+        return CommandResult(True, status_text)
+    
+    async def _cmd_my_members(self, ctx: CommandContext) -> CommandResult:
+        if not ctx.open_id:
+            return CommandResult(False, "无法识别操作人")
+        
+        miz_ids = user_manager.get_users_by_open_id(ctx.open_id)
+        if not miz_ids:
+            return CommandResult(True, "您当前没有添加的成员")
+        
+        quota_text = f"/{self.operator_quota}" if self.operator_quota else ""
+        lines = [f"👥 我的成员（{len(miz_ids)}{quota_text}）"]
+        lines.extend(self._format_member_line(miz_id) for miz_id in miz_ids)
+        return CommandResult(True, "\n".join(lines))
+    
+    async def _cmd_expiring(self, ctx: CommandContext) -> CommandResult:
+        hours = float(ctx.args[0]) if ctx.args else 1
+        
+        miz_ids = user_manager.get_expiring_users(hours * 3600)
+        if not miz_ids:
+            return CommandResult(True, f"未来{hours:g}小时内没有即将过期的成员")
+        
+        lines = [f"⏰ 未来{hours:g}小时内即将过期的成员（{len(miz_ids)}）"]
+        lines.extend(self._format_member_line(miz_id) for miz_id in miz_ids)
+        return CommandResult(True, "\n".join(lines))
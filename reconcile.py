@@ -0,0 +1,246 @@
+"""
+成员对账模块
+分页读取觅智网企业成员列表，与本地用户数据做集合比对，并按限速批量执行纠正操作
+
+在机器人进程内由管理员指令"成员对账"触发，与机器人共用同一份用户数据和重试队列
+"""
+import asyncio
+import datetime
+import json
+import os
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+
+from user_manager import user_manager
+
+if TYPE_CHECKING:
+    from feishu_bot import FeishuBot
+
+
+class Reconciler:
+    def __init__(self, bot: "FeishuBot", state_file: str = "data/reconcile_state.json", page_size: int = 100,
+                 rate: float = 2.0, protected_ids: Optional[Set[str]] = None, max_pages: int = 100):
+        """初始化对账任务
+
+        Args:
+            bot: 飞书机器人实例，用于读取成员列表和执行添加/删除
+            state_file: 上次对账状态文件路径（增量模式使用）
+            page_size: 读取成员列表的每页条数
+            rate: 纠正操作的速率上限（次/秒）
+            protected_ids: 不受对账影响的企业成员（如管理员、长期成员）
+            max_pages: 读取成员列表的最大页数
+        """
+        self.bot = bot
+        self.state_file = state_file
+        self.page_size = page_size
+        self.rate = rate
+        self.protected_ids = protected_ids or set()
+        self.max_pages = max_pages
+        # 运行中时为停止请求事件，在事件循环中创建
+        self._stop_requested: Optional[asyncio.Event] = None
+
+    def _log(self, message: str) -> None:
+        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][成员对账] {message}")
+
+    def _load_state(self) -> Dict[str, Any]:
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (json.JSONDecodeError, FileNotFoundError):
+                return {}
+        return {}
+
+    def _save_state(self, state: Dict[str, Any]) -> None:
+        directory = os.path.dirname(self.state_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.state_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+
+    async def fetch_roster_async(self) -> Set[str]:
+        """分页读取完整的企业成员名单
+
+        接口忽略分页参数时会反复返回同一页，因此某页没有新成员时即停止，并限制最大页数
+        """
+        roster: Set[str] = set()
+        for page in range(1, self.max_pages + 1):
+            result = await self.bot.fetch_company_members_async(page, self.page_size)
+            if not result.get('success'):
+                raise Exception(f"读取企业成员列表第{page}页失败: {result.get('message')}")
+
+            members = result['members']
+            before = len(roster)
+            roster.update(members)
+            total = result.get('total')
+            if len(members) < self.page_size or (total is not None and len(roster) >= total):
+                return roster
+            if len(roster) == before:
+                self._log(f"第{page}页没有新成员，接口可能不支持分页，停止读取")
+                return roster
+        raise Exception(f"企业成员列表超过 {self.max_pages} 页仍未读完，已停止对账")
+
+    def plan(self, remote: Set[str], local: Dict[str, Dict], state: Optional[Dict[str, Any]] = None) -> Dict[str, List[str]]:
+        """根据企业成员名单和本地数据生成纠正计划
+
+        Args:
+            remote: 企业成员名单
+            local: 本地用户数据
+            state: 上次对账状态，传入时只检查此后发生变化的条目（增量模式）
+
+        Returns:
+            Dict[str, List[str]]: 各类纠正操作对应的miz_id列表
+                readd: 本地未过期但企业中缺失，需要重新添加
+                delete: 本地已过期但仍在企业中，需要删除
+                drop_local: 本地已过期且已不在企业中，只需清理本地记录
+                orphans: 企业中存在但本地没有记录的成员
+        """
+        now = time.time()
+        local_ids = set(local)
+        active = {miz_id for miz_id, info in local.items() if info.get('expire_time', 0) > now}
+        expired = local_ids - active
+        orphans = remote - local_ids - self.protected_ids
+
+        if state:
+            last_run = state.get('last_run', 0)
+            failed_ids = set(state.get('failed_ids', []))
+            # 上次对账后新增的条目、有效期在此期间到期的条目、此后从企业中消失的成员，以及上次纠正失败的条目
+            changed = {
+                miz_id for miz_id, info in local.items()
+                if info.get('add_time', 0) > last_run or last_run < info.get('expire_time', 0) <= now
+            }
+            changed |= set(state.get('remote_ids', [])) - remote
+            changed |= failed_ids
+            active &= changed
+            expired &= changed
+            # 新出现在企业中的成员、上次对账后从本地移除的成员，以及上次删除失败的成员
+            orphans &= (remote - set(state.get('remote_ids', []))) | (set(state.get('local_ids', [])) - local_ids) | failed_ids
+
+        return {
+            "readd": sorted(active - remote),
+            "delete": sorted(expired & remote),
+            "drop_local": sorted(expired - remote),
+            "orphans": sorted(orphans),
+        }
+
+    async def _execute(self, plan: Dict[str, List[str]], local: Dict[str, Dict], remove_orphans: bool) -> Tuple[Dict[str, Dict[str, int]], List[str]]:
+        """按速率上限并发执行纠正操作
+
+        Returns:
+            Tuple[Dict[str, Dict[str, int]], List[str]]: 各类操作的成功/失败数，以及执行失败的miz_id
+        """
+        operations = [("readd", miz_id) for miz_id in plan["readd"]]
+        operations += [("delete", miz_id) for miz_id in plan["delete"]]
+        if remove_orphans:
+            operations += [("orphans", miz_id) for miz_id in plan["orphans"]]
+
+        for miz_id in plan["drop_local"]:
+            await self.bot.engine.run_blocking(user_manager.remove_user, miz_id)
+
+        async def run_one(index: int, kind: str, miz_id: str) -> Dict[str, Any]:
+            # 按序号错开启动时间，实现速率限制；等待期间收到停止请求时不再执行，记为失败留给下次增量对账
+            if not await self._wait_turn(index / self.rate):
+                return {"success": False, "message": "机器人正在关闭，未执行"}
+            operator_id = local.get(miz_id, {}).get('open_id')
+            if kind == "readd":
+                result = await self.bot.add_member_async(miz_id, operator_id, check_local=False)
+            else:
+                result = await self.bot.delete_member_async(miz_id, operator_id)
+            if not result.get('success'):
+                self._log(f"{kind} {miz_id} 失败: {result.get('message')}")
+            return result
+
+        results = await asyncio.gather(*(run_one(i, kind, miz_id) for i, (kind, miz_id) in enumerate(operations)))
+
+        summary = {kind: {"success": 0, "failed": 0} for kind in ("readd", "delete", "orphans")}
+        failed_ids = []
+        for (kind, miz_id), result in zip(operations, results):
+            summary[kind]["success" if result.get('success') else "failed"] += 1
+            if not result.get('success'):
+                failed_ids.append(miz_id)
+        summary["drop_local"] = {"success": len(plan["drop_local"]), "failed": 0}
+        return summary, sorted(failed_ids)
+
+    async def _wait_turn(self, delay: float) -> bool:
+        """等待到操作的启动时间
+
+        Returns:
+            bool: 是否可以执行（等待期间收到停止请求时返回False）
+        """
+        try:
+            await asyncio.wait_for(self._stop_requested.wait(), delay)
+            return False
+        except asyncio.TimeoutError:
+            return True
+
+    def request_stop(self) -> None:
+        """请求停止正在运行的对账（可在任意线程调用），尚未开始的纠正操作不再执行"""
+        if self._stop_requested is not None:
+            self.bot.engine.loop.call_soon_threadsafe(self._stop_requested.set)
+
+    async def run_async(self, dry_run: bool = False, incremental: bool = False, remove_orphans: bool = False) -> Dict[str, Any]:
+        """执行一次对账
+
+        Args:
+            dry_run: 只生成报告，不执行任何纠正操作
+            incremental: 只检查上次对账后发生变化的条目
+            remove_orphans: 是否从企业中删除本地没有记录的成员
+
+        Returns:
+            Dict[str, Any]: 对账报告
+        """
+        started = time.time()
+        self._stop_requested = asyncio.Event()
+        state = await self.bot.engine.run_blocking(self._load_state) if incremental else None
+        if incremental and not state:
+            self._log("没有上次对账记录，执行全量对账")
+
+        remote = await self.fetch_roster_async()
+        local = user_manager.get_all_users()
+        plan = self.plan(remote, local, state or None)
+
+        report: Dict[str, Any] = {
+            "mode": "incremental" if state else "full",
+            "dry_run": dry_run,
+            "remote_count": len(remote),
+            "local_count": len(local),
+            "plan": plan,
+        }
+
+        if not dry_run:
+            report["result"], failed_ids = await self._execute(plan, local, remove_orphans)
+            # 失败的条目写入状态，下次增量对账时重新检查
+            await self.bot.engine.run_blocking(self._save_state, {
+                "last_run": started,
+                "local_ids": sorted(user_manager.get_all_users()),
+                "remote_ids": sorted(remote),
+                "failed_ids": failed_ids,
+            })
+
+        report["elapsed"] = time.time() - started
+        return report
+
+
+def format_report(report: Dict[str, Any], max_ids: int = 20) -> str:
+    """将对账报告渲染为回复文本，每类最多列出max_ids个miz_id"""
+    labels = {
+        "readd": "本地有效但企业中缺失（重新添加）",
+        "delete": "本地已过期但仍在企业中（删除）",
+        "drop_local": "本地已过期且不在企业中（清理本地记录）",
+        "orphans": "企业中存在但本地无记录",
+    }
+    lines = [
+        f"📋 成员对账（{'增量' if report['mode'] == 'incremental' else '全量'}{'，仅预览' if report['dry_run'] else ''}）",
+        f"企业成员 {report['remote_count']} 个，本地记录 {report['local_count']} 个，耗时 {report['elapsed']:.1f}秒",
+    ]
+    for kind, label in labels.items():
+        miz_ids = report["plan"][kind]
+        line = f"• {label}: {len(miz_ids)} 个"
+        if "result" in report and kind in report["result"]:
+            result = report["result"][kind]
+            line += f"，成功 {result['success']} 个，失败 {result['failed']} 个"
+        lines.append(line)
+        if miz_ids:
+            more = f" 等{len(miz_ids)}个" if len(miz_ids) > max_ids else ""
+            lines.append(f"    {', '.join(miz_ids[:max_ids])}{more}")
+    return "\n".join(lines)
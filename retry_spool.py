@@ -0,0 +1,336 @@
+"""
+磁盘重试队列模块
+以追加写的段文件持久化失败的删除操作和未发送的多维表格记录，后台按指数退避持续重试
+"""
+import json
+import os
+import time
+import uuid
+import datetime
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+
+class RetrySpool:
+    def __init__(self, spool_file: str = "data/retry_spool.log", max_entries: int = 1000,
+                 base_delay: float = 30, max_delay: float = 3600, max_attempts: int = 10):
+        """初始化重试队列
+
+        Args:
+            spool_file: 段文件路径，每行一条JSON操作记录（put/retry/ack）
+            max_entries: 队列最大条目数，超出时丢弃最早的条目
+            base_delay: 首次重试的退避时间（秒）
+            max_delay: 退避时间上限（秒）
+            max_attempts: 最大重试次数，超过后放弃该条目
+        """
+        self.spool_file = spool_file
+        self.max_entries = max_entries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], bool]] = {}
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._keys: Dict[str, str] = {}
+        self._dead_lines = 0
+        self._drained_times: Deque[float] = deque()
+        self._drained_total = 0
+        self._dropped_total = 0
+        self._thread: Optional[threading.Thread] = None
+
+        self._replay()
+
+    def _log(self, message: str) -> None:
+        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][重试队列] {message}")
+
+    def _replay(self) -> None:
+        """启动时回放段文件，重建待重试条目"""
+        if not os.path.exists(self.spool_file):
+            return
+
+        total_lines = 0
+        torn = False
+        with open(self.spool_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                torn = not line.endswith("\n")
+                line = line.strip()
+                if not line:
+                    continue
+                total_lines += 1
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 进程中断可能留下半行，跳过即可
+                    continue
+
+                op = record.get('op')
+                entry_id = record.get('id')
+                if op == 'put':
+                    self._entries[entry_id] = {
+                        'id': entry_id,
+                        'kind': record['kind'],
+                        'key': record.get('key'),
+                        'payload': record.get('payload', {}),
+                        'attempts': record.get('attempts', 0),
+                        'next_retry': record.get('next_retry', 0),
+                    }
+                elif op == 'retry' and entry_id in self._entries:
+                    self._entries[entry_id]['attempts'] = record.get('attempts', 0)
+                    self._entries[entry_id]['next_retry'] = record.get('next_retry', 0)
+                elif op == 'ack':
+                    self._entries.pop(entry_id, None)
+
+        self._keys = {e['key']: e['id'] for e in self._entries.values() if e.get('key')}
+        self._dead_lines = total_lines - len(self._entries)
+
+        if self._entries:
+            self._log(f"从 {self.spool_file} 恢复 {len(self._entries)} 条待重试记录")
+        # 末尾的半行之后继续追加会把新记录拼到半行上，因此直接重写段文件
+        self._compact_if_needed(force=torn)
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        """追加一条操作记录到段文件"""
+        directory = os.path.dirname(self.spool_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.spool_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _compact_if_needed(self, force: bool = False) -> None:
+        """已确认的记录过多（或force为True）时重写段文件，只保留仍在等待的条目"""
+        if not force and self._dead_lines <= max(100, len(self._entries)):
+            return
+
+        tmp_file = self.spool_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            for entry in self._entries.values():
+                f.write(json.dumps(dict(entry, op='put'), ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.spool_file)
+        self._dead_lines = 0
+
+    def _backoff(self, attempts: int) -> float:
+        """计算第attempts次失败后的退避时间"""
+        return min(self.max_delay, self.base_delay * (2 ** max(attempts - 1, 0)))
+
+    def register_handler(self, kind: str, handler: Callable[[Dict[str, Any]], bool]) -> None:
+        """注册某类条目的重试处理函数，处理函数返回True表示成功"""
+        self._handlers[kind] = handler
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], key: Optional[str] = None) -> bool:
+        """加入一条待重试记录
+
+        Args:
+            kind: 条目类型，对应已注册的处理函数
+            payload: 处理函数所需的参数
+            key: 去重键，相同键的条目未完成前不会重复入队
+
+        Returns:
+            bool: 是否新加入队列（已存在相同键时返回False）
+        """
+        with self._lock:
+            if key and key in self._keys:
+                return False
+
+            if len(self._entries) >= self.max_entries:
+                oldest_id, oldest = self._entries.popitem(last=False)
+                if oldest.get('key'):
+                    self._keys.pop(oldest['key'], None)
+                self._append({'op': 'ack', 'id': oldest_id})
+                self._dead_lines += 2
+                self._dropped_total += 1
+                self._log(f"队列已满，丢弃最早的记录 {oldest['kind']}: {oldest['payload']}")
+
+            entry = {
+                'id': uuid.uuid4().hex,
+                'kind': kind,
+                'key': key,
+                'payload': payload,
+                'attempts': 0,
+                'next_retry': time.time() + self.base_delay,
+            }
+            self._entries[entry['id']] = entry
+            if key:
+                self._keys[key] = entry['id']
+            self._append(dict(entry, op='put'))
+
+        self._wakeup.set()
+        return True
+
+    def has_key(self, key: str) -> bool:
+        """检查指定去重键是否仍有未完成的条目"""
+        with self._lock:
+            return key in self._keys
+
+    def _finish(self, entry_id: str, drained: bool) -> None:
+        """移除已完成或已放弃的条目"""
+        entry = self._entries.pop(entry_id, None)
+        if not entry:
+            return
+        if entry.get('key'):
+            self._keys.pop(entry['key'], None)
+        self._append({'op': 'ack', 'id': entry_id})
+        self._dead_lines += 2
+        if drained:
+            self._drained_total += 1
+            self._drained_times.append(time.time())
+        else:
+            self._dropped_total += 1
+        self._compact_if_needed()
+
+    def process_due(self) -> int:
+        """处理所有到期条目
+
+        Returns:
+            int: 本轮成功处理的条目数
+        """
+        now = time.time()
+        with self._lock:
+            due = [dict(e) for e in self._entries.values() if e['next_retry'] <= now]
+
+        drained = 0
+        for entry in due:
+            # 正在停止时不再开始新的条目，剩余条目保留在段文件中
+            if self._stopping.is_set():
+                break
+            handler = self._handlers.get(entry['kind'])
+            if not handler:
+                continue
+
+            try:
+                success = bool(handler(entry['payload']))
+            except Exception as e:
+                self._log(f"处理 {entry['kind']} 时发生错误: {e}")
+                success = False
+
+            with self._lock:
+                if entry['id'] not in self._entries:
+                    continue
+                if success:
+                    self._finish(entry['id'], drained=True)
+                    drained += 1
+                    continue
+
+                attempts = entry['attempts'] + 1
+                if attempts >= self.max_attempts:
+                    self._log(f"{entry['kind']} 重试 {attempts} 次仍失败，放弃: {entry['payload']}")
+                    self._finish(entry['id'], drained=False)
+                    continue
+
+                next_retry = time.time() + self._backoff(attempts)
+                self._entries[entry['id']].update(attempts=attempts, next_retry=next_retry)
+                self._append({'op': 'retry', 'id': entry['id'], 'attempts': attempts, 'next_retry': next_retry})
+                self._dead_lines += 1
+
+        return drained
+
+    def _next_due_in(self) -> float:
+        """距离最早到期条目的秒数"""
+        with self._lock:
+            if not self._entries:
+                return self.max_delay
+            earliest = min(e['next_retry'] for e in self._entries.values())
+        return max(0.0, earliest - time.time())
+
+    def start(self) -> None:
+        """启动后台重试线程"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def worker():
+            while not self._stopping.is_set():
+                try:
+                    self.process_due()
+                except Exception as e:
+                    self._log(f"重试任务发生错误: {e}")
+                self._wakeup.wait(timeout=min(self._next_due_in(), self.base_delay) or 1)
+                self._wakeup.clear()
+
+        self._thread = threading.Thread(target=worker, name="retry-spool", daemon=True)
+        self._thread.start()
+        self._log("后台重试任务已启动")
+
+    def stop(self, timeout: Optional[float] = None) -> bool:
+        """停止后台重试线程，等待正在处理的条目完成
+
+        Returns:
+            bool: 线程是否已在期限内退出
+        """
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is None:
+            return True
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def get_metrics(self, window: float = 600) -> Dict[str, Any]:
+        """获取队列指标
+
+        Args:
+            window: 计算排空速率的时间窗口（秒）
+
+        Returns:
+            Dict[str, Any]: 待处理数、累计完成数、累计丢弃数和排空速率（条/分钟）
+        """
+        now = time.time()
+        with self._lock:
+            while self._drained_times and self._drained_times[0] < now - window:
+                self._drained_times.popleft()
+            return {
+                "pending": len(self._entries),
+                "drained_total": self._drained_total,
+                "dropped_total": self._dropped_total,
+                "drain_rate_per_min": len(self._drained_times) * 60 / window,
+            }
+
+
+if __name__ == "__main__":
+    # 测试代码：崩溃后回放与段文件压缩
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as workdir:
+        spool_file = os.path.join(workdir, "retry_spool.log")
+
+        # 入队3条，完成1条，再写入半行模拟进程在追加写时中断
+        spool = RetrySpool(spool_file, base_delay=0)
+        spool.register_handler("ok", lambda payload: True)
+        spool.enqueue("delete_member", {"miz_id": "11111"}, key="delete:11111")
+        spool.enqueue("bitable_record", {"data": 1})
+        spool.enqueue("ok", {})
+        assert not spool.enqueue("delete_member", {"miz_id": "11111"}, key="delete:11111")
+        assert spool.process_due() == 1
+        with open(spool_file, 'a', encoding='utf-8') as f:
+            f.write('{"op": "put", "id": "torn')
+
+        recovered = RetrySpool(spool_file, base_delay=0)
+        print("崩溃后恢复的条目:", [entry['kind'] for entry in recovered._entries.values()])
+        assert [entry['kind'] for entry in recovered._entries.values()] == ["delete_member", "bitable_record"]
+        assert recovered.has_key("delete:11111")
+
+        # 半行之后追加的记录在下次启动时不能丢失
+        recovered.enqueue("bitable_record", {"data": 2})
+        assert len(RetrySpool(spool_file)._entries) == 3
+        with recovered._lock:
+            recovered._finish(next(reversed(recovered._entries)), drained=True)
+
+        # 大量条目完成后段文件被压缩，只保留仍在等待的条目
+        recovered.register_handler("ok", lambda payload: True)
+        for i in range(300):
+            recovered.enqueue("ok", {"index": i})
+        assert recovered.process_due() == 300
+        with open(spool_file, 'r', encoding='utf-8') as f:
+            line_count = sum(1 for line in f if line.strip())
+        print("压缩后段文件行数:", line_count, "待重试:", recovered.get_metrics()['pending'])
+        # 未压缩时300条的入队和确认共600行
+        assert line_count < 300
+
+        reopened = RetrySpool(spool_file)
+        assert sorted(entry['kind'] for entry in reopened._entries.values()) == ["bitable_record", "delete_member"]
+        print("重启后待重试:", reopened.get_metrics()['pending'])
@@ -3,13 +3,19 @@
 使用飞书SDK的WebSocket长连接机制处理事件和回调
 """
 import os
-import json
 import signal
+import concurrent.futures
 import datetime
-import sys
+import itertools
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
 import lark_oapi as lark
 from dotenv import load_dotenv
+from command_router import CommandResult
 from feishu_bot import FeishuBot
+from traffic_capture import TrafficRecorder
+import tracing
 
 # 加载环境变量
 load_dotenv()
@@ -17,140 +23,138 @@ load_dotenv()
 # 初始化飞书机器人
 bot = FeishuBot()
 
-def do_p2_im_message_receive_v1(data: lark.im.v1.P2ImMessageReceiveV1) -> None:
+# 事件流量录制（配置TRAFFIC_CAPTURE_FILE后启用）
+recorder = TrafficRecorder.from_env()
+
+# 已提交但尚未处理完的消息事件：序号 -> (事件, Future)，关闭时未完成的写入热重启快照
+_inflight_events: Dict[int, Tuple[Dict[str, Any], concurrent.futures.Future]] = {}
+_event_seq = itertools.count()
+# 关闭过程中收到的事件不再执行，与未完成事件一起写入快照；快照写入后收到的事件直接拒绝
+_deferred_events: List[Dict[str, Any]] = []
+_accepting = True
+_snapshot_saved = False
+_intake_lock = threading.Lock()
+# 收到退出信号后由信号处理函数设置，主线程据此执行优雅关闭
+_shutdown_requested = False
+
+def do_p2_im_message_receive_v1(data: lark.im.v1.P2ImMessageReceiveV1) -> concurrent.futures.Future:
     """
     处理v2.0版本的消息事件
+    
+    消息处理提交到机器人的异步引擎执行，不阻塞长连接的事件分发
+    返回处理任务的Future（结果为指令处理结果），供流量回放工具统计耗时和失败数
     """
     print(f'[{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}][消息事件]: 用户ID：{data.event.sender.sender_id.user_id} - 发送了消息：{data.event.message.content}')
     
-    try:
-        # 提取消息内容
-        event_data = data.event
-        if hasattr(event_data, 'message') and hasattr(event_data.message, 'content'):
-            # 解析消息内容
-            content_json = json.loads(event_data.message.content)
-            text = content_json.get('text', '').strip()
-            
-            # 创建模拟事件格式给机器人处理
-            event = {
-                "event": {
-                    "message": {
-                        "content": event_data.message.content
-                    }
+    if recorder:
+        try:
+            recorder.record(
+                "im.message.receive_v1",
+                data.event.sender.sender_id.open_id,
+                data.event.sender.sender_id.user_id,
+                data.event.message.content,
+                getattr(data.event.message, 'message_type', None),
+                getattr(data.event.message, 'chat_type', None)
+            )
+        except Exception as e:
+            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][流量录制-失败] {e}")
+    
+    # 事件同时携带user_id和open_id，顺便写入通讯录缓存
+    bot.contact_cache.prime(data.event.sender.sender_id.user_id, data.event.sender.sender_id.open_id)
+    
+    # 创建模拟事件格式给机器人处理，消息内容由指令路由统一解析
+    event = {
+        "event": {
+            "sender": {
+                "sender_id": {
+                    "open_id": data.event.sender.sender_id.open_id,
+                    "user_id": data.event.sender.sender_id.user_id
                 }
+            },
+            "message": {
+                "content": data.event.message.content
             }
-            
-            # 调用机器人处理消息
-            result = bot.handle_message(event)
-            # print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][处理结果] {result}")
-            
-            # 处理添加成员和删除成员指令，传递正确的飞书open_id
-            if text.startswith("添加成员") or text.startswith("删除成员"):
-                parts = text.split()
-                if len(parts) >= 2:
-                    miz_id = parts[1]
-                    open_id = data.event.sender.sender_id.open_id
-                    
-                    if text.startswith("添加成员"):
-                        result = bot.add_member(miz_id, open_id)
-                    else:
-                        result = bot.delete_member(miz_id, open_id)
-                    
-                    # 打印处理结果
-                    # print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][处理结果] {result}")
-                    
-                    # 直接发送回复消息，不再走下面的通用回复逻辑
-                    # 根据操作类型和结果发送不同的提示消息，包含用户ID和失败原因
-                    if result.get('success'):
-                        # 成功情况
-                        if text.startswith("添加成员"):
-                            message = f"添加用户 {miz_id} 成功"
-                        else:
-                            message = f"删除用户 {miz_id} 成功"
-                    else:
-                        # 失败情况
-                        if text.startswith("添加成员"):
-                            message = f"添加用户 {miz_id} 失败，原因：{result.get('message', '未知错误')}"    
-                        else:
-                            message = f"删除用户 {miz_id} 失败，原因：{result.get('message', '未知错误')}"
-                    
-                    try:
-                        # 使用飞书SDK发送回复消息
-                        from lark_oapi.api.im.v1 import CreateMessageRequest, CreateMessageRequestBody
-                        from lark_oapi import JSON
-                        
-                        # 构建回复消息内容
-                        reply_content = JSON.marshal({"text": message})
-                        
-                        # 创建API客户端
-                        client = lark.Client.builder() \
-                            .app_id(os.getenv('FEISHU_APP_ID')) \
-                            .app_secret(os.getenv('FEISHU_APP_SECRET')) \
-                            .build()
-                        
-                        # 发送回复
-                        request = CreateMessageRequest.builder() \
-                            .receive_id_type("open_id") \
-                            .request_body(CreateMessageRequestBody.builder()
-                                .receive_id(data.event.sender.sender_id.open_id)
-                                .msg_type("text")
-                                .content(reply_content)
-                                .build()) \
-                            .build()
-                        
-                        response = client.im.v1.message.create(request)
-                        
-                        if response.success():
-                            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][发送消息事件-成功] 向用户ID：{data.event.sender.sender_id.user_id} 发送消息成功")
-                        else:
-                            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][发送消息事件-失败] 向用户ID：{data.event.sender.sender_id.user_id} 发送消息失败，原因：{response.msg}, LogID: {response.get_log_id()}")
-                            
-                    except Exception as send_error:
-                        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][发送消息事件-失败] 向用户ID：{data.event.sender.sender_id.user_id} 发送消息失败，原因：{send_error}")
-                    
-                    # 直接返回，不再走下面的通用处理逻辑
-                    return
-            
-            # 发送回复消息给用户
-            if result.get('success') and result.get('message'):
-                try:
-                    # 使用飞书SDK发送回复消息
-                    from lark_oapi.api.im.v1 import CreateMessageRequest, CreateMessageRequestBody
-                    from lark_oapi import JSON
-                    
-                    # 构建回复消息内容
-                    reply_content = JSON.marshal({"text": result['message']})
-                    
-                    # 创建API客户端
-                    client = lark.Client.builder() \
-                        .app_id(os.getenv('FEISHU_APP_ID')) \
-                        .app_secret(os.getenv('FEISHU_APP_SECRET')) \
-                        .build()
-                    
-                    # 发送回复
-                    request = CreateMessageRequest.builder() \
-                        .receive_id_type("open_id") \
-                        .request_body(CreateMessageRequestBody.builder()
-                            .receive_id(data.event.sender.sender_id.open_id)
-                            .msg_type("text")
-                            .content(reply_content)
-                            .build()) \
-                        .build()
-                    
-                    response = client.im.v1.message.create(request)
-                    
-                    if response.success():
-                        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][发送消息事件-成功] 向用户ID：{data.event.sender.sender_id.user_id} 发送消息成功")
-                    else:
-                        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][发送消息事件-失败] 向用户ID：{data.event.sender.sender_id.user_id} 发送消息失败，原因：{response.msg}, LogID: {response.get_log_id()}")
-                        
-                except Exception as send_error:
-                    print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][发送消息事件-失败] 向用户ID：{data.event.sender.sender_id.user_id} 发送消息失败，原因：{send_error}")
+        }
+    }
+    return _submit_event(event)
+
+def _submit_event(event: Dict[str, Any]) -> concurrent.futures.Future:
+    """
+    将消息事件提交到异步引擎，并登记为未完成事件直到处理结束
+    
+    关闭过程中收到的事件不再执行，直接留给热重启快照；快照已写入时抛出异常，
+    事件不被确认，由飞书重新投递给下一个实例
+    """
+    with _intake_lock:
+        if not _accepting:
+            if _snapshot_saved:
+                raise RuntimeError("正在关闭，快照已写入，拒绝新事件")
+            _deferred_events.append(event)
+            future = concurrent.futures.Future()
+            future.set_result(None)
+            return future
+        
+        # 为本条消息建立链路，处理协程继承该链路
+        trace = tracing.new_trace("消息事件", user_id=event['event']['sender']['sender_id'].get('user_id'))
+        with tracing.activate(trace):
+            future = bot.engine.submit(_process_message_event(event))
+        
+        seq = next(_event_seq)
+        _inflight_events[seq] = (event, future)
+    future.add_done_callback(lambda done: _on_event_done(seq, done))
+    return future
+
+def _on_event_done(seq: int, future: concurrent.futures.Future) -> None:
+    # 因关闭超时被取消的事件保留在登记表中，写入快照后由下一个实例重新执行
+    if not future.cancelled():
+        with _intake_lock:
+            _inflight_events.pop(seq, None)
+
+async def _send_reply(open_id: str, user_id: Optional[str], message: str) -> None:
+    """
+    向消息发送者回复文本消息
+    """
+    response = await bot.send_reply_async(open_id, message)
+    
+    if response.get('success'):
+        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][发送消息事件-成功] 向用户ID：{user_id} 发送消息成功")
+    else:
+        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][发送消息事件-失败] 向用户ID：{user_id} 发送消息失败，原因：{response.get('message')}, LogID: {response.get('log_id', 'N/A')}")
+
+async def _process_message_event(event: Dict[str, Any]) -> Optional[CommandResult]:
+    """
+    消息处理流水线：解析指令、执行对应处理、回复用户
+    
+    返回指令处理结果，处理过程中出错时返回None
+    """
+    profile = bot.profiler.begin()
+    result = None
+    try:
+        # 调用机器人处理消息
+        result = await bot.dispatch_event_async(event)
+        
+        # 发送回复消息给用户（成员操作无论成功失败都回复，其他指令仅成功时回复）
+        reply_text = result.reply_text
+        if reply_text:
+            sender_id = event['event']['sender']['sender_id']
+            await _send_reply(sender_id.get('open_id'), sender_id.get('user_id'), reply_text)
+        return result
             
     except Exception as e:
         # 尝试获取飞书SDK的logid
         log_id = getattr(e, 'log_id', 'N/A')
         print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][处理消息时出错] {e}, LogID: {log_id}")
+        return None
+    finally:
+        if profile is not None:
+            bot.profiler.end(profile)
+        tracing.finish_trace(bot.slow_command_threshold_ms)
+        # profile文件在线程池中写入，不阻塞事件循环，也不计入本条指令的链路耗时
+        if profile is not None:
+            try:
+                await bot.engine.run_blocking(bot.profiler.save, profile, result.command if result else None)
+            except Exception as e:
+                print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][性能分析-失败] 写入profile失败: {e}")
 
 def do_p2_chat_access_event_bot_p2p_chat_entered_v1(data: lark.CustomizedEvent) -> None:
     """
@@ -264,12 +268,62 @@ event_handler = lark.EventDispatcherHandler.builder(os.getenv('FEISHU_VERIFICATI
     .register_p2_customized_event("im.chat.p2p_chat_create", do_p2p_chat_create_event) \
     .build()
 
+def shutdown(timeout: float) -> None:
+    """
+    优雅关闭：停止接收新事件，在期限内等待已提交的事件（含排队中的成员操作）处理完成，
+    超时未完成的事件连同访问令牌和通讯录缓存写入热重启快照，由下一个实例接管执行；
+    最后停止过期用户检查、重试队列和成员对账，等待其中进行的操作完成后再停止事件循环
+    """
+    global _accepting
+    with _intake_lock:
+        _accepting = False
+        futures = [future for _, future in _inflight_events.values()]
+    
+    print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][优雅关闭] 停止接收新事件，等待 {len(futures)} 条处理中的事件，最长 {timeout:.0f} 秒")
+    started = time.monotonic()
+    _, not_done = concurrent.futures.wait(futures, timeout=timeout)
+    for future in not_done:
+        future.cancel()
+    print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][优雅关闭] 等待 {time.monotonic() - started:.1f} 秒，{len(futures) - len(not_done)} 条已完成，{len(not_done)} 条未完成")
+    
+    # 持锁写入快照，保证关闭过程中收到的事件要么进入快照，要么被拒绝
+    global _snapshot_saved
+    with _intake_lock:
+        pending_events = [event for event, future in _inflight_events.values() if future.cancelled() or not future.done()]
+        pending_events.extend(_deferred_events)
+        try:
+            bot.save_warm_state(pending_events)
+        except Exception as e:
+            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][优雅关闭] 保存热重启快照失败: {e}")
+        _snapshot_saved = True
+    
+    # 等待过期用户检查、重试队列和成员对账中进行的操作完成后再停止事件循环，
+    # 避免觅智网删除成功后、本地记录更新前操作被丢弃
+    if not bot.stop_background_tasks(timeout):
+        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][优雅关闭] 后台任务未在 {timeout:.0f} 秒内停止")
+    bot.engine.stop()
+
 def signal_handler(sig, frame):
     """
-    处理Ctrl+C信号的优雅退出
+    处理Ctrl+C和SIGTERM信号：只设置退出标记，由主线程在信号处理函数之外执行优雅关闭，再次收到信号时立即退出
     """
+    global _shutdown_requested
+    if _shutdown_requested:
+        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][再次收到退出信号，立即退出]")
+        os._exit(1)
+    _shutdown_requested = True
     print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][正在关闭SDK连接客户端...]")
-    sys.exit(0)
+
+def _run_client(cli: lark.ws.Client) -> None:
+    """
+    在后台线程中运行长连接客户端（阻塞式运行）
+    """
+    try:
+        cli.start()
+    except Exception as e:
+        # 尝试获取飞书SDK的logid
+        log_id = getattr(e, 'log_id', 'N/A')
+        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][SDK连接客户端启动时出错] {e}, LogID: {log_id}")
 
 def main():
     """
@@ -277,6 +331,7 @@ def main():
     """
     # 注册信号处理器
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
     
     # 从环境变量获取应用凭证
     app_id = os.getenv('FEISHU_APP_ID')
@@ -292,6 +347,10 @@ def main():
     print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][正在连接飞书开放平台...]")
     print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][按 Ctrl+C 可关闭连接，程序将退出]")
     
+    # 重新提交上次关闭时未处理完的指令
+    for event in bot.warm_pending_events:
+        _submit_event(event)
+    
     try:
         # 初始化长连接客户端
         cli = lark.ws.Client(
@@ -301,11 +360,14 @@ def main():
             log_level=lark.LogLevel.INFO
         )
         
-        # 启动客户端（阻塞式运行）
-        cli.start()
+        # 长连接在后台线程运行，主线程等待退出信号（或客户端异常退出）后执行优雅关闭
+        client_thread = threading.Thread(target=_run_client, args=(cli,), name="lark-ws", daemon=True)
+        client_thread.start()
+        while not _shutdown_requested and client_thread.is_alive():
+            time.sleep(0.5)
+        
+        shutdown(float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '20')))
         
-    except KeyboardInterrupt:
-        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][收到中断信号，正在关闭连接...]")
     except Exception as e:
         # 尝试获取飞书SDK的logid
         log_id = getattr(e, 'log_id', 'N/A')
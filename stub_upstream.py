@@ -0,0 +1,138 @@
+"""
+本地上游桩服务模块
+模拟飞书开放平台与觅智网接口，用于压测和流量回放，不访问真实服务
+"""
+import asyncio
+import json
+import os
+import threading
+from typing import Optional, Set
+
+from aiohttp import web
+
+
+class StubUpstream:
+    def __init__(self, latency: float = 0.05, host: str = "127.0.0.1", port: int = 0):
+        """初始化桩服务
+
+        Args:
+            latency: 每个请求的模拟响应延迟（秒）
+            host: 监听地址
+            port: 监听端口，0表示随机分配
+        """
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.request_count = 0
+        # 模拟的企业成员名单，随添加/删除请求变化
+        self.members: Set[str] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def configure_environment(self, workdir: str) -> None:
+        """将机器人的所有上游地址和数据文件指向本桩服务与临时目录
+
+        需要在导入feishu_bot/sdk_connect之前调用，保证全局实例使用临时数据文件
+        """
+        har_file = os.path.join(workdir, "cookie.har")
+        with open(har_file, "w", encoding="utf-8") as f:
+            json.dump({"log": {"entries": [{"request": {"url": f"{self.base_url}/v1/company/addMember", "headers": [{"name": "Cookie", "value": "stub=1"}]}}]}}, f)
+
+        os.environ.update({
+            "FEISHU_APP_ID": "stub_app",
+            "FEISHU_APP_SECRET": "stub_secret",
+            "FEISHU_VERIFICATION_TOKEN": "stub_verification_token",
+            "FEISHU_ENCRYPT_KEY": "stub_encrypt_key",
+            "FEISHU_API_BASE": self.base_url,
+            "MIZ_API_BASE": self.base_url,
+            "MIZ_WWW_BASE": self.base_url,
+            "BITABLE_APP_TOKEN": "stub_app_token",
+            "BITABLE_TABLE_ID": "stub_table",
+            "HAR_FILE": har_file,
+            "USER_DATA_FILE": os.path.join(workdir, "user_data.json"),
+            "RETRY_SPOOL_FILE": os.path.join(workdir, "retry_spool.log"),
+            "WARM_STATE_FILE": os.path.join(workdir, "warm_state.json"),
+        })
+
+    async def _delay(self) -> None:
+        self.request_count += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+    async def _tenant_access_token(self, request: web.Request) -> web.Response:
+        await self._delay()
+        return web.json_response({"code": 0, "msg": "ok", "tenant_access_token": "t-stub", "expire": 7200})
+
+    async def _add_member(self, request: web.Request) -> web.Response:
+        await self._delay()
+        form = await request.post()
+        self.members.add(str(form.get('userid')))
+        return web.json_response({"code": 200, "msg": "添加员工成功", "data": ""})
+
+    async def _miz_www(self, request: web.Request) -> web.Response:
+        await self._delay()
+        form = await request.post()
+        if request.query.get('a') == 'DelCompanyMember':
+            self.members.discard(str(form.get('userid')))
+            return web.json_response({"status": 200, "msg": "删除成功"})
+        if request.query.get('a') == 'CompanyMemberList':
+            page, page_size = int(form.get('page', 1)), int(form.get('pagesize', 100))
+            members = sorted(self.members)
+            items = [{"userid": miz_id} for miz_id in members[(page - 1) * page_size:page * page_size]]
+            return web.json_response({"status": 200, "msg": "ok", "data": {"list": items, "total": len(members)}})
+        return web.json_response({"status": 404, "msg": "未知接口"})
+
+    async def _bitable_record(self, request: web.Request) -> web.Response:
+        await self._delay()
+        data = await request.json()
+        return web.json_response({"code": 0, "msg": "success", "data": {"record": {"record_id": "rec_stub", "fields": data.get('fields', {})}}})
+
+    async def _im_message(self, request: web.Request) -> web.Response:
+        await self._delay()
+        return web.json_response({"code": 0, "msg": "success", "data": {}})
+
+    async def _contact_users_batch(self, request: web.Request) -> web.Response:
+        await self._delay()
+        items = [{"user_id": user_id, "open_id": f"ou_stub_{user_id}"} for user_id in request.query.getall('user_ids', [])]
+        return web.json_response({"code": 0, "msg": "success", "data": {"items": items}})
+
+    def _build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/open-apis/auth/v3/tenant_access_token/internal/", self._tenant_access_token)
+        app.router.add_post("/v1/company/addMember", self._add_member)
+        app.router.add_post("/", self._miz_www)
+        app.router.add_post("/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records", self._bitable_record)
+        app.router.add_post("/open-apis/im/v1/messages", self._im_message)
+        app.router.add_get("/open-apis/contact/v3/users/batch", self._contact_users_batch)
+        return app
+
+    def start(self) -> None:
+        """在后台线程启动桩服务，返回时已可接受请求"""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._runner = web.AppRunner(self._build_app(), access_log=None)
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, self.host, self.port)
+            self._loop.run_until_complete(site.start())
+            self.port = site._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="stub-upstream", daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop(self) -> None:
+        """停止桩服务"""
+        if not self._loop:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
@@ -0,0 +1,183 @@
+"""
+请求链路追踪模块
+为每条消息建立轻量级的span树，耗时超过阈值的指令输出完整链路；支持按需对接下来的N条指令采集cProfile
+"""
+import cProfile
+import datetime
+import functools
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# 当前所在的span与所属链路的根span，随协程上下文传递
+_current_span: ContextVar[Optional["Span"]] = ContextVar('current_span', default=None)
+_current_trace: ContextVar[Optional["Span"]] = ContextVar('current_trace', default=None)
+
+
+class Span:
+    def __init__(self, name: str, attrs: Optional[Dict[str, Any]] = None):
+        """初始化span
+
+        Args:
+            name: 步骤名称
+            attrs: 附加属性（如miz_id、指令名）
+        """
+        self.name = name
+        self.attrs = attrs or {}
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.children: List["Span"] = []
+        self.error: Optional[str] = None
+
+    def finish(self) -> None:
+        if self.end is None:
+            self.end = time.perf_counter()
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start) * 1000
+
+    def format_tree(self, origin: Optional[float] = None, depth: int = 0) -> str:
+        """格式化为缩进的span树，每行包含相对根span的开始时间和耗时"""
+        origin = self.start if origin is None else origin
+        attrs = " ".join(f"{key}={value}" for key, value in self.attrs.items())
+        line = f"{'    ' * depth}- {self.name} +{(self.start - origin) * 1000:.1f}ms 耗时 {self.duration_ms:.1f}ms"
+        if attrs:
+            line += f" {attrs}"
+        if self.error:
+            line += f" 错误={self.error}"
+        lines = [line]
+        lines.extend(child.format_tree(origin, depth + 1) for child in self.children)
+        return "\n".join(lines)
+
+
+def new_trace(name: str, **attrs) -> Span:
+    """创建链路的根span（尚未激活）"""
+    return Span(name, attrs)
+
+
+@contextmanager
+def activate(root: Span) -> Iterator[Span]:
+    """在当前上下文中激活链路，之后创建的协程会继承该链路"""
+    trace_token = _current_trace.set(root)
+    span_token = _current_span.set(root)
+    try:
+        yield root
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+
+def current_trace() -> Optional[Span]:
+    """获取当前链路的根span，不在链路中时返回None"""
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Optional[Span]]:
+    """记录一个步骤，不在链路中时不做任何事"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(name, attrs)
+    parent.children.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = type(e).__name__
+        raise
+    finally:
+        child.finish()
+        _current_span.reset(token)
+
+
+def traced(name: str) -> Callable:
+    """为异步函数记录span的装饰器"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def finish_trace(threshold_ms: float) -> Optional[Span]:
+    """结束当前链路，耗时超过阈值时输出完整的span树
+
+    Returns:
+        Optional[Span]: 已结束的根span，不在链路中时返回None
+    """
+    root = _current_trace.get()
+    if root is None:
+        return None
+
+    root.finish()
+    if root.duration_ms >= threshold_ms:
+        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][慢指令] 耗时 {root.duration_ms:.1f}ms 超过阈值 {threshold_ms:.0f}ms，完整链路:\n{root.format_tree()}")
+    return root
+
+
+class ProfileSampler:
+    def __init__(self, output_dir: str = "data/profiles"):
+        """初始化按需cProfile采集器
+
+        Args:
+            output_dir: profile文件输出目录，可用 python -m pstats 或 snakeviz 查看
+        """
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._active: Optional[cProfile.Profile] = None
+
+    def arm(self, count: int) -> None:
+        """对接下来的count条指令采集profile"""
+        with self._lock:
+            self._remaining = count
+
+    def begin(self) -> Optional[cProfile.Profile]:
+        """开始采集，在事件循环线程中调用
+
+        同一线程同时只能有一个profiler，已有采集进行中的指令不会被采样。
+        采集期间事件循环上并发执行的其他指令也会计入profile
+        """
+        with self._lock:
+            if self._remaining <= 0 or self._active is not None:
+                return None
+            self._remaining -= 1
+            self._active = cProfile.Profile()
+
+        try:
+            self._active.enable()
+        except ValueError:
+            # 已有其他profiler在运行
+            with self._lock:
+                self._active = None
+            return None
+        return self._active
+
+    def end(self, profile: cProfile.Profile) -> None:
+        """结束采集，在事件循环线程中调用（写入文件由save在事件循环之外执行）"""
+        profile.disable()
+        with self._lock:
+            self._active = None
+
+    def save(self, profile: cProfile.Profile, label: Optional[str]) -> str:
+        """将已结束的profile写入文件，包含文件读写，不应在事件循环线程中调用
+
+        Returns:
+            str: profile文件路径
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        filename = f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{label or 'unknown'}_{uuid.uuid4().hex[:6]}.prof"
+        path = os.path.join(self.output_dir, filename)
+        profile.dump_stats(path)
+        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][性能分析] 已写入 {path}，剩余采样 {self._remaining} 条")
+        return path
@@ -0,0 +1,155 @@
+"""
+事件流量录制模块
+将收到的消息事件脱敏后追加写入按大小轮转的JSONL文件，供traffic_replay.py回放压测
+"""
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# 觅智网用户ID：5-20位的连续数字（前后不紧邻其他数字），不依赖参数之间的分隔符
+_DIGIT_ID_PATTERN = re.compile(r'(?<![0-9])[0-9]{5,20}(?![0-9])')
+# 消息中@提及等携带的飞书open_id/union_id
+_OPEN_ID_PATTERN = re.compile(r'\b(ou|on)_[0-9A-Za-z]{8,}')
+
+
+class TrafficRecorder:
+    def __init__(self, capture_file: str, key: str, max_bytes: int = 50 * 1024 * 1024, backup_count: int = 5):
+        """初始化录制器
+
+        Args:
+            capture_file: 录制文件路径
+            key: 脱敏使用的HMAC密钥，不能为空（没有密钥时假名可被穷举还原）
+            max_bytes: 单个文件的大小上限，超出后轮转
+            backup_count: 保留的历史文件数（capture_file.1 ~ capture_file.N）
+        """
+        if not key:
+            raise ValueError("流量录制需要配置脱敏密钥")
+        self.capture_file = capture_file
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._key = key.encode('utf-8')
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["TrafficRecorder"]:
+        """根据环境变量创建录制器，未配置TRAFFIC_CAPTURE_FILE或TRAFFIC_CAPTURE_KEY时返回None（不录制）"""
+        capture_file = os.getenv('TRAFFIC_CAPTURE_FILE')
+        if not capture_file:
+            return None
+        key = os.getenv('TRAFFIC_CAPTURE_KEY')
+        if not key:
+            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][流量录制] 未配置脱敏密钥 TRAFFIC_CAPTURE_KEY，不录制流量")
+            return None
+        return cls(
+            capture_file,
+            key,
+            max_bytes=int(os.getenv('TRAFFIC_CAPTURE_MAX_BYTES', str(50 * 1024 * 1024))),
+            backup_count=int(os.getenv('TRAFFIC_CAPTURE_BACKUPS', '5'))
+        )
+
+    def _digest(self, value: str) -> str:
+        return hmac.new(self._key, value.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def redact_id(self, value: Optional[str], prefix: str) -> Optional[str]:
+        """将飞书用户ID替换为稳定的假名，同一用户在录制中保持一致"""
+        if not value:
+            return value
+        return f"{prefix}{self._digest(value)[:24]}"
+
+    def redact_digits(self, value: str) -> str:
+        """将纯数字参数（觅智网用户ID）替换为等长的假名数字，保持ID格式校验结果不变"""
+        digest = int(self._digest(value), 16)
+        # 首位取1-9，其余位取哈希值的末尾数字
+        tail = str(digest // 9)[-(len(value) - 1):] if len(value) > 1 else ''
+        return str(1 + digest % 9) + tail
+
+    def redact_text(self, text: str) -> str:
+        """脱敏一段文本：替换其中5-20位的数字ID和飞书用户ID，换行、全角空格等分隔符原样保留"""
+        text = _DIGIT_ID_PATTERN.sub(lambda match: self.redact_digits(match.group()), text)
+        return _OPEN_ID_PATTERN.sub(lambda match: self.redact_id(match.group(), f"{match.group(1)}_"), text)
+
+    def _redact_value(self, value: Any) -> Any:
+        """递归脱敏JSON中的每个字符串和整数"""
+        if isinstance(value, str):
+            return self.redact_text(value)
+        if isinstance(value, dict):
+            return {key: self._redact_value(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._redact_value(item) for item in value]
+        if isinstance(value, int) and not isinstance(value, bool) and 5 <= len(str(abs(value))) <= 20:
+            redacted = int(self.redact_digits(str(abs(value))))
+            return -redacted if value < 0 else redacted
+        return value
+
+    def redact_content(self, content: str) -> str:
+        """脱敏消息内容：保留指令关键字和普通数字参数，替换其中的数字ID和飞书用户ID
+
+        文本、富文本等任意结构的JSON都逐个字段处理；不是JSON时按纯文本处理，无法处理的内容整体隐去
+        """
+        if not isinstance(content, str):
+            return "[已隐去]"
+        try:
+            content_json = json.loads(content)
+        except ValueError:
+            return self.redact_text(content)
+        return json.dumps(self._redact_value(content_json), ensure_ascii=False)
+
+    def _rotate(self) -> None:
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.capture_file}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.capture_file}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.capture_file, f"{self.capture_file}.1")
+        else:
+            os.remove(self.capture_file)
+
+    def record(self, event_type: str, open_id: Optional[str], user_id: Optional[str], content: str,
+               message_type: Optional[str] = None, chat_type: Optional[str] = None) -> None:
+        """追加一条脱敏后的事件记录"""
+        record = {
+            "ts": time.time(),
+            "type": event_type,
+            "sender": {
+                "open_id": self.redact_id(open_id, "ou_"),
+                "user_id": self.redact_id(user_id, "u_"),
+            },
+            "message": {
+                "message_type": message_type,
+                "chat_type": chat_type,
+                "content": self.redact_content(content),
+            },
+        }
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+
+        with self._lock:
+            directory = os.path.dirname(self.capture_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if os.path.exists(self.capture_file) and os.path.getsize(self.capture_file) + len(line.encode('utf-8')) > self.max_bytes:
+                self._rotate()
+            with open(self.capture_file, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+def load_capture(paths: List[str]) -> List[Dict[str, Any]]:
+    """按时间顺序读取录制文件中的事件"""
+    events = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    events.sort(key=lambda event: event.get('ts', 0))
+    return events
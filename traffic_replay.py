@@ -0,0 +1,141 @@
+"""
+事件流量回放工具
+将录制的消息事件按原始时间间隔（可加速）送入sdk_connect的事件处理函数，上游全部指向本地桩服务，输出吞吐量和延迟
+
+用法: python traffic_replay.py data/traffic_capture.jsonl [--speed 10] [--latency 0.05]
+      --speed 1 按原速回放，--speed 10 十倍速，--speed 0 不等待、以最快速度回放
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+from stub_upstream import StubUpstream
+from traffic_capture import load_capture
+
+
+def _to_sdk_event(record: Dict[str, Any]) -> SimpleNamespace:
+    """将录制记录还原为与飞书SDK消息事件结构一致的对象"""
+    sender = record.get('sender', {})
+    message = record.get('message', {})
+    return SimpleNamespace(event=SimpleNamespace(
+        sender=SimpleNamespace(sender_id=SimpleNamespace(open_id=sender.get('open_id'), user_id=sender.get('user_id'))),
+        message=SimpleNamespace(
+            content=message.get('content', ''),
+            message_type=message.get('message_type'),
+            chat_type=message.get('chat_type')
+        )
+    ))
+
+
+def _command_of(record: Dict[str, Any], router) -> str:
+    text = router.parse_content(record.get('message', {}).get('content', ''))
+    return text.split()[0] if text.split() else ""
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent))]
+
+
+def replay(records: List[Dict[str, Any]], speed: float, handler, router) -> Dict[str, Any]:
+    """按录制时间间隔回放事件，等待全部处理完成后返回统计结果"""
+    latencies: Dict[str, List[float]] = {}
+    errors = Counter()
+    lock = threading.Lock()
+    futures = []
+
+    def on_done(command: str, submitted: float):
+        def callback(future):
+            elapsed = time.perf_counter() - submitted
+            # 处理出错（结果为None）或指令返回失败都计为失败
+            failed = future.cancelled() or future.exception() is not None or not getattr(future.result(), 'success', False)
+            with lock:
+                latencies.setdefault(command, []).append(elapsed)
+                if failed:
+                    errors[command] += 1
+        return callback
+
+    first_ts = records[0].get('ts', 0)
+    started = time.perf_counter()
+    for record in records:
+        if speed > 0:
+            delay = (record.get('ts', first_ts) - first_ts) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+        command = _command_of(record, router)
+        submitted = time.perf_counter()
+        future = handler(_to_sdk_event(record))
+        future.add_done_callback(on_done(command, submitted))
+        futures.append(future)
+
+    for future in futures:
+        try:
+            future.result()
+        except Exception:
+            pass
+
+    return {
+        "elapsed": time.perf_counter() - started,
+        "latencies": latencies,
+        "errors": errors,
+    }
+
+
+def _print_report(report: Dict[str, Any], total: int, speed: float, upstream_requests: int) -> None:
+    all_latencies = [value for values in report["latencies"].values() for value in values]
+    speed_text = "最快速度" if speed <= 0 else f"{speed:g}倍速"
+    print(f"回放 {total} 条事件（{speed_text}），耗时 {report['elapsed']:.2f}秒，吞吐量 {total / report['elapsed']:.1f} 条/秒，上游请求 {upstream_requests} 次")
+    print(f"{'指令':<12}{'数量':>8}{'失败':>8}{'P50(ms)':>12}{'P95(ms)':>12}{'P99(ms)':>12}{'最大(ms)':>12}")
+    rows = sorted(report["latencies"].items(), key=lambda item: -len(item[1]))
+    rows.append(("全部", all_latencies))
+    for command, values in rows:
+        failed = sum(report["errors"].values()) if command == "全部" else report["errors"][command]
+        print(f"{command or '(空)':<12}{len(values):>8}{failed:>8}"
+              f"{statistics.median(values) * 1000:>12.1f}{_percentile(values, 0.95) * 1000:>12.1f}"
+              f"{_percentile(values, 0.99) * 1000:>12.1f}{max(values) * 1000:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放录制的飞书消息事件进行压测")
+    parser.add_argument("captures", nargs="+", help="录制文件（traffic_capture.jsonl 及其轮转文件）")
+    parser.add_argument("--speed", type=float, default=1, help="回放倍速，0表示不等待、以最快速度回放")
+    parser.add_argument("--latency", type=float, default=0.05, help="桩服务模拟的上游延迟（秒）")
+    parser.add_argument("--verbose", action="store_true", help="输出机器人处理日志")
+    args = parser.parse_args()
+
+    records = [record for record in load_capture(args.captures) if record.get('type') == "im.message.receive_v1"]
+    if not records:
+        print("录制文件中没有可回放的消息事件")
+        return
+
+    stub = StubUpstream(latency=args.latency)
+    stub.start()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        stub.configure_environment(workdir)
+        # 回放时不再录制
+        os.environ['TRAFFIC_CAPTURE_FILE'] = ''
+
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            # 环境变量准备好之后再导入，事件处理函数使用桩服务和临时数据文件
+            import sdk_connect
+            report = replay(records, args.speed, sdk_connect.do_p2_im_message_receive_v1, sdk_connect.bot.router)
+
+        _print_report(report, len(records), args.speed, stub.request_count)
+        sdk_connect.bot.engine.stop()
+
+    stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,18 @@
 """
 用户有效期管理模块
 存储用户添加时间，管理24小时有效期，防止重复添加和自动删除过期用户
+维护按操作人和按过期时间分桶的二级索引，查询代价与结果数量成正比
 """
 import json
+import math
 import os
 import time
+import threading
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set
+
+# 过期时间索引的分桶粒度（秒）
+EXPIRY_BUCKET_SECONDS = 3600
 
 class UserManager:
     def __init__(self, data_file: str = "data/user_data.json"):
@@ -16,23 +22,80 @@ class UserManager:
             data_file: 用户数据存储文件路径
         """
         self.data_file = data_file
+        self._lock = threading.RLock()
         self.users = self._load_users()
+        
+        # 二级索引：open_id -> miz_id集合，过期时间分桶 -> miz_id集合
+        self._by_open_id: Dict[str, Set[str]] = {}
+        self._by_expiry_bucket: Dict[int, Set[str]] = {}
+        for miz_id, user_data in self.users.items():
+            self._index_add(miz_id, user_data)
+        
+        # 正在添加中（已预占名额、等待觅智网接口返回）的用户：miz_id -> open_id，以及各操作人的预占数
+        self._reservations: Dict[str, Optional[str]] = {}
+        self._reserved_by_open_id: Dict[str, int] = {}
     
     def _load_users(self) -> Dict[str, Dict]:
-        """从文件加载用户数据"""
+        """从文件加载用户数据（文件损坏时另存一份再从空数据开始，避免下次保存时覆盖）"""
         if os.path.exists(self.data_file):
             try:
                 with open(self.data_file, 'r', encoding='utf-8') as f:
                     return json.load(f)
-            except (json.JSONDecodeError, FileNotFoundError):
+            except json.JSONDecodeError as e:
+                backup_file = f"{self.data_file}.corrupt-{int(time.time())}"
+                os.replace(self.data_file, backup_file)
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][用户管理-错误] 用户数据文件损坏（{e}），已另存为 {backup_file}")
+                return {}
+            except FileNotFoundError:
                 return {}
         return {}
     
+    @staticmethod
+    def _bucket_of(expire_time: float) -> int:
+        return int(expire_time // EXPIRY_BUCKET_SECONDS)
+    
+    def _index_add(self, miz_id: str, user_data: Dict) -> None:
+        """将用户加入二级索引"""
+        open_id = user_data.get('open_id')
+        if open_id:
+            self._by_open_id.setdefault(open_id, set()).add(miz_id)
+        bucket = self._bucket_of(user_data.get('expire_time', 0))
+        self._by_expiry_bucket.setdefault(bucket, set()).add(miz_id)
+    
+    def _index_remove(self, miz_id: str, user_data: Dict) -> None:
+        """将用户从二级索引中移除"""
+        open_id = user_data.get('open_id')
+        if open_id in self._by_open_id:
+            self._by_open_id[open_id].discard(miz_id)
+            if not self._by_open_id[open_id]:
+                del self._by_open_id[open_id]
+        bucket = self._bucket_of(user_data.get('expire_time', 0))
+        if bucket in self._by_expiry_bucket:
+            self._by_expiry_bucket[bucket].discard(miz_id)
+            if not self._by_expiry_bucket[bucket]:
+                del self._by_expiry_bucket[bucket]
+    
+    def _unreserve(self, miz_id: str) -> None:
+        """移除预占记录并更新操作人的预占数（调用方需持有锁）"""
+        if miz_id not in self._reservations:
+            return
+        open_id = self._reservations.pop(miz_id)
+        if open_id:
+            self._reserved_by_open_id[open_id] -= 1
+            if not self._reserved_by_open_id[open_id]:
+                del self._reserved_by_open_id[open_id]
+    
     def _save_users(self) -> None:
-        """保存用户数据到文件"""
-        os.makedirs(os.path.dirname(self.data_file), exist_ok=True)
-        with open(self.data_file, 'w', encoding='utf-8') as f:
+        """保存用户数据到文件（先写临时文件再替换，写到一半时进程退出也不会损坏原文件）"""
+        directory = os.path.dirname(self.data_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_file = f"{self.data_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             json.dump(self.users, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.data_file)
     
     def add_user(self, miz_id: str, open_id: Optional[str] = None) -> bool:
         """添加用户并记录添加时间
@@ -46,25 +109,68 @@ class UserManager:
         """
         current_time = time.time()
         
-        # 检查用户是否在24小时内已存在且未过期
-        if miz_id in self.users:
-            user_data = self.users[miz_id]
-            expire_time = user_data.get('expire_time', 0)
+        with self._lock:
+            # 检查用户是否在24小时内已存在且未过期
+            if miz_id in self.users:
+                user_data = self.users[miz_id]
+                expire_time = user_data.get('expire_time', 0)
+                
+                # 如果用户未过期，不允许重复添加
+                if current_time < expire_time:
+                    return False
+                
+                self._index_remove(miz_id, user_data)
+            
+            # 预占的名额转为正式记录
+            self._unreserve(miz_id)
             
-            # 如果用户未过期，不允许重复添加
-            if current_time < expire_time:
-                return False
-        
-        # 添加或更新用户信息
-        self.users[miz_id] = {
-            'add_time': current_time,
-            'open_id': open_id,
-            'expire_time': current_time + 24 * 3600  # 24小时后过期
-        }
-        
-        self._save_users()
+            # 添加或更新用户信息
+            self.users[miz_id] = {
+                'add_time': current_time,
+                'open_id': open_id,
+                'expire_time': current_time + 24 * 3600  # 24小时后过期
+            }
+            self._index_add(miz_id, self.users[miz_id])
+            
+            self._save_users()
         return True
     
+    def reserve_user(self, miz_id: str, open_id: Optional[str] = None, quota: int = 0) -> Optional[str]:
+        """为添加操作预占名额：原子地检查24小时重复添加和操作人配额，通过后登记为添加中
+        
+        预占成功后必须调用add_user（转为正式记录）或release_user（释放名额）
+        
+        Args:
+            miz_id: 觅智网用户ID
+            open_id: 操作人飞书用户ID
+            quota: 操作人名下成员数上限，0表示不限制
+            
+        Returns:
+            Optional[str]: 预占失败的原因，成功时返回None
+        """
+        with self._lock:
+            if miz_id in self._reservations:
+                return "该用户正在添加中，请稍后查看结果"
+            if not self.can_add_user(miz_id):
+                return "该用户24小时内已添加过，请等待有效期结束后再添加"
+            
+            # 重新添加自己名下已过期的用户不占用新配额，添加中的用户计入配额
+            if quota and open_id:
+                user_data = self.users.get(miz_id)
+                owned = user_data is not None and user_data.get('open_id') == open_id
+                if not owned and self.count_users_by_open_id(open_id) + self._reserved_by_open_id.get(open_id, 0) >= quota:
+                    return f"您名下的成员已达上限 {quota} 个，请等待到期或删除后再添加"
+            
+            self._reservations[miz_id] = open_id
+            if open_id:
+                self._reserved_by_open_id[open_id] = self._reserved_by_open_id.get(open_id, 0) + 1
+            return None
+    
+    def release_user(self, miz_id: str) -> None:
+        """释放reserve_user预占的名额（已通过add_user转为正式记录时不做任何事）"""
+        with self._lock:
+            self._unreserve(miz_id)
+    
     def can_add_user(self, miz_id: str) -> bool:
         """检查用户是否可以被添加（用户已过期）
         
@@ -74,10 +180,10 @@ class UserManager:
         Returns:
             bool: 是否可以添加
         """
-        if miz_id not in self.users:
+        user_data = self.users.get(miz_id)
+        if user_data is None:
             return True
             
-        user_data = self.users[miz_id]
         expire_time = user_data.get('expire_time', 0)
         
         # 如果用户已过期，则可以再次添加
@@ -90,12 +196,17 @@ class UserManager:
             List[str]: 过期用户的miz_id列表
         """
         current_time = time.time()
+        current_bucket = self._bucket_of(current_time)
         expired_users = []
         
-        for miz_id, user_data in self.users.items():
-            expire_time = user_data.get('expire_time', 0)
-            if current_time >= expire_time:
-                expired_users.append(miz_id)
+        # 只检查过期时间落在当前分桶及之前的用户
+        with self._lock:
+            for bucket, miz_ids in self._by_expiry_bucket.items():
+                if bucket > current_bucket:
+                    continue
+                for miz_id in miz_ids:
+                    if current_time >= self.users[miz_id].get('expire_time', 0):
+                        expired_users.append(miz_id)
         
         return expired_users
     
@@ -108,10 +219,11 @@ class UserManager:
         Returns:
             bool: 是否成功移除
         """
-        if miz_id in self.users:
-            del self.users[miz_id]
-            self._save_users()
-            return True
+        with self._lock:
+            if miz_id in self.users:
+                self._index_remove(miz_id, self.users.pop(miz_id))
+                self._save_users()
+                return True
         return False
     
     def get_user_info(self, miz_id: str) -> Optional[Dict]:
@@ -142,22 +254,136 @@ class UserManager:
         Returns:
             Dict[str, Dict]: 所有用户数据的字典
         """
-        return self.users.copy()
+        with self._lock:
+            return self.users.copy()
+    
+    def get_users_by_open_id(self, open_id: str) -> List[str]:
+        """获取某个操作人添加的用户（包含已过期但尚未删除的用户）
+        
+        Args:
+            open_id: 飞书用户ID
+            
+        Returns:
+            List[str]: 按过期时间排序的miz_id列表
+        """
+        with self._lock:
+            miz_ids = self._by_open_id.get(open_id, set())
+            return sorted(miz_ids, key=lambda miz_id: self.users[miz_id].get('expire_time', 0))
+    
+    def count_users_by_open_id(self, open_id: str) -> int:
+        """统计某个操作人名下的用户数
+        
+        Args:
+            open_id: 飞书用户ID
+            
+        Returns:
+            int: 用户数（包含已过期但尚未从企业删除的用户）
+        """
+        with self._lock:
+            return len(self._by_open_id.get(open_id, ()))
+    
+    def get_expiring_users(self, within_seconds: float) -> List[str]:
+        """获取将在指定时间内过期的用户（不包含已过期用户）
+        
+        Args:
+            within_seconds: 时间范围（秒）
+            
+        Returns:
+            List[str]: 按过期时间排序的miz_id列表
+        """
+        # 同时排除nan和非正数
+        if not within_seconds > 0:
+            return []
+        
+        current_time = time.time()
+        deadline = current_time + within_seconds
+        expiring_users = []
+        
+        with self._lock:
+            first_bucket = self._bucket_of(current_time)
+            # 范围超过已有桶数（包括inf）时直接遍历已有的桶，避免按时间范围逐个枚举
+            if math.isinf(deadline) or self._bucket_of(deadline) - first_bucket >= len(self._by_expiry_bucket):
+                buckets = [bucket for bucket in self._by_expiry_bucket if bucket >= first_bucket]
+            else:
+                buckets = range(first_bucket, self._bucket_of(deadline) + 1)
+            
+            for bucket in buckets:
+                for miz_id in self._by_expiry_bucket.get(bucket, ()):
+                    expire_time = self.users[miz_id].get('expire_time', 0)
+                    if current_time < expire_time <= deadline:
+                        expiring_users.append(miz_id)
+            return sorted(expiring_users, key=lambda miz_id: self.users[miz_id].get('expire_time', 0))
 
-# 全局用户管理器实例
-user_manager = UserManager()
+# 全局用户管理器实例（可通过USER_DATA_FILE环境变量指定数据文件，便于压测隔离）
+user_manager = UserManager(os.getenv('USER_DATA_FILE', 'data/user_data.json'))
 
 if __name__ == "__main__":
-    # 测试代码
-    manager = UserManager("test_user_data.json")
-    
-    # 测试添加用户
-    print("添加用户12345:", manager.add_user("12345", "test_open_id"))
-    print("再次添加用户12345:", manager.add_user("12345", "test_open_id"))
+    # 测试代码：二级索引维护、并发预占配额、即将过期查询的边界
+    import tempfile
     
-    # 测试获取过期用户
-    print("过期用户:", manager.get_expired_users())
-    
-    # 清理测试文件
-    if os.path.exists("test_user_data.json"):
-        os.remove("test_user_data.json")
\ No newline at end of file
+    with tempfile.TemporaryDirectory() as workdir:
+        data_file = os.path.join(workdir, "test_user_data.json")
+        manager = UserManager(data_file)
+        
+        # 测试添加用户
+        print("添加用户12345:", manager.add_user("12345", "test_open_id"))
+        print("再次添加用户12345:", manager.add_user("12345", "test_open_id"))
+        
+        # 测试获取过期用户
+        print("过期用户:", manager.get_expired_users())
+        
+        # 添加和移除时同步维护操作人索引和过期时间分桶，移除后不留下空集合
+        bucket = manager._bucket_of(manager.users["12345"]["expire_time"])
+        assert manager._by_open_id == {"test_open_id": {"12345"}}
+        assert manager._by_expiry_bucket == {bucket: {"12345"}}
+        assert manager.remove_user("12345")
+        assert manager._by_open_id == {} and manager._by_expiry_bucket == {}
+        
+        # 重新添加已过期的用户：从旧分桶和旧操作人下移到新的
+        now = time.time()
+        with open(data_file, 'w', encoding='utf-8') as f:
+            json.dump({"23456": {"add_time": now - 90000, "open_id": "ou_old", "expire_time": now - 3600 * 3}}, f)
+        manager = UserManager(data_file)
+        assert manager.get_expired_users() == ["23456"]
+        assert manager.add_user("23456", "ou_new")
+        assert manager._by_open_id == {"ou_new": {"23456"}}
+        assert manager._by_expiry_bucket == {manager._bucket_of(manager.users["23456"]["expire_time"]): {"23456"}}
+        print("分桶索引:", manager._by_expiry_bucket, "操作人索引:", manager._by_open_id)
+        
+        # 并发预占：配额为3、名下已有1个时，20个线程同时预占只有2个成功
+        barrier = threading.Barrier(20)
+        errors: List[Optional[str]] = []
+        
+        def reserve(index: int) -> None:
+            barrier.wait()
+            errors.append(manager.reserve_user(str(30000 + index), "ou_new", quota=3))
+        
+        threads = [threading.Thread(target=reserve, args=(index,)) for index in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        reserved = sorted(manager._reservations)
+        print("并发预占成功:", reserved)
+        assert errors.count(None) == 2 and manager._reserved_by_open_id == {"ou_new": 2}
+        assert manager.reserve_user(reserved[0], "ou_other") == "该用户正在添加中，请稍后查看结果"
+        
+        # 添加成功的预占转为正式记录，失败的释放后名额可以再次使用
+        assert manager.add_user(reserved[0], "ou_new")
+        manager.release_user(reserved[0])
+        manager.release_user(reserved[1])
+        assert manager._reservations == {} and manager._reserved_by_open_id == {}
+        assert manager.count_users_by_open_id("ou_new") == 2
+        assert manager.reserve_user("40000", "ou_new", quota=3) is None
+        assert manager.reserve_user("40001", "ou_new", quota=3) is not None
+        manager.release_user("40000")
+        
+        # 即将过期：inf和超大范围只遍历已有的分桶，nan和非正数返回空
+        for within_seconds in (float("inf"), 1e12):
+            started = time.perf_counter()
+            assert sorted(manager.get_expiring_users(within_seconds)) == ["23456", reserved[0]]
+            assert time.perf_counter() - started < 0.1
+        for within_seconds in (float("nan"), 0, -3600):
+            assert manager.get_expiring_users(within_seconds) == []
+        assert manager.get_expiring_users(3600) == []
+        print("即将过期(inf):", manager.get_expiring_users(float("inf")))
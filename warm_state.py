@@ -0,0 +1,71 @@
+"""
+热重启状态快照模块
+关闭时保存访问令牌、通讯录缓存和未处理完的指令，下次启动时接管快照后立即恢复
+"""
+import datetime
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+# 快照格式版本，格式不兼容时递增
+SNAPSHOT_VERSION = 1
+
+
+class WarmStateStore:
+    def __init__(self, state_file: str = "data/warm_state.json", max_age: float = 3600):
+        """初始化快照存储
+
+        Args:
+            state_file: 快照文件路径
+            max_age: 快照的最长有效时间（秒），过旧的快照只丢弃不恢复
+        """
+        self.state_file = state_file
+        self.max_age = max_age
+
+    def save(self, state: Dict[str, Any]) -> None:
+        """写入快照（先写临时文件再替换，避免写到一半时被接管）"""
+        snapshot = dict(state, version=SNAPSHOT_VERSION, saved_at=time.time(), pid=os.getpid())
+        directory = os.path.dirname(self.state_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        tmp_file = f"{self.state_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.state_file)
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """接管快照：先原子地改名再读取，保证快照只被接管一次
+
+        Returns:
+            Optional[Dict[str, Any]]: 快照内容，没有可用快照时返回None
+        """
+        claimed_file = f"{self.state_file}.{os.getpid()}.claimed"
+        try:
+            os.replace(self.state_file, claimed_file)
+        except FileNotFoundError:
+            return None
+
+        try:
+            with open(claimed_file, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][热重启] 读取快照失败: {e}")
+            return None
+        finally:
+            try:
+                os.remove(claimed_file)
+            except OSError:
+                pass
+
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][热重启] 快照版本 {snapshot.get('version')} 不兼容，已忽略")
+            return None
+        age = time.time() - snapshot.get('saved_at', 0)
+        if age > self.max_age:
+            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][热重启] 快照已保存 {age:.0f} 秒，超过有效期，已忽略（其中 {len(snapshot.get('pending_events', []))} 条未处理指令不再执行）")
+            return None
+        return snapshot